@@ -0,0 +1,186 @@
+# Times opening and saving a project in its separate phases, headless: parsing the file, creating the items in the
+# scene, collecting their data and writing the file. Reports items per second and memory for every phase, and can
+# compare the results with an earlier run to catch regressions.
+#
+#   python -m benchmarks.bench_project --items 100000 --layers 4 --format .cdp
+#   python -m benchmarks.bench_project --file large.cdp --json results.json
+#   python -m benchmarks.bench_project --items 100000 --baseline results.json --tolerance 0.2
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from benchmarks.generate_project import DEFAULT_MIX, DEFAULT_VARIANTS, generate_project, parse_mix
+from cdproject.projectfile import readProject, writeProject
+from cdproject.serializers import serializerForFile
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = {
+    'style': 'dark',
+    'default_theme': 'Default',
+    'default_chip_width': 20,
+    'default_chip_height': 10,
+    'default_chip_margin': 2
+}
+
+
+def peak_rss():
+    # Peak resident memory of the whole process so far in MB, where the platform reports it. It never goes down, so it
+    # is the peak up to the end of a phase, not the peak of that phase.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def start_application(directory):
+    # The main window with its settings and themes in a directory of its own, so that nothing has to be downloaded
+    from PyQt6.QtCore import QSettings
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([])
+
+    shutil.copytree(os.path.join(REPOSITORY, "configuration", "themes"), os.path.join(directory, "themes"))
+    settings = QSettings(os.path.join(directory, "settings.ini"), QSettings.Format.IniFormat)
+    for key, value in SETTINGS.items():
+        settings.setValue(key, value)
+    settings.setValue('default_directory', directory)
+
+    # The user interface is loaded relative to the repository
+    os.chdir(REPOSITORY)
+    from mainwindow import MainWindow
+
+    window = MainWindow(settings)
+    return app, window
+
+
+class Phase:
+    def __init__(self, name, trace):
+        self.name = name
+        self.trace = trace
+        self.seconds = float('inf')
+        self.traced = None
+        self.process_rss = None
+
+    def run(self, function, repeat, setup=None):
+        # The best time of all runs, memory of the first. The setup before every run is not measured.
+        result = None
+        for i in range(repeat):
+            if setup:
+                setup()
+            if self.trace and i == 0:
+                tracemalloc.start()
+            start = time.perf_counter()
+            result = function()
+            self.seconds = min(self.seconds, time.perf_counter() - start)
+            if self.trace and i == 0:
+                self.traced = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+        self.process_rss = peak_rss()
+        return result
+
+    def results(self, items):
+        return {'seconds': self.seconds, 'items_per_second': items / self.seconds,
+                'traced_mb': self.traced, 'process_peak_rss_mb': self.process_rss}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark opening and saving projects")
+    parser.add_argument("--file", help="existing project to use instead of a generated one")
+    parser.add_argument("--items", type=int, default=50000, help="number of blocks on the generated chip")
+    parser.add_argument("--layers", type=int, default=2, help="number of layers the blocks are spread over")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="relative number of blocks per type, for example straight=4,bend=1")
+    parser.add_argument("--variants", type=int, default=DEFAULT_VARIANTS,
+                        help="number of distinct shapes per block type, 0 for a shape per block")
+    parser.add_argument("--format", default=".cdp", help="extension of the generated and written files")
+    parser.add_argument("--repeat", type=int, default=3, help="the best of this many runs is reported")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also measure the peak of Python allocations per phase (slows the first run down)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction by which a phase may be slower than the baseline")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The application is started from the repository, so a project given relative to the current directory would no
+    # longer be found
+    file = os.path.abspath(args.file) if args.file else None
+
+    with tempfile.TemporaryDirectory() as directory:
+        app, window = start_application(directory)
+        project = window.drawing_area
+
+        if not file:
+            random.seed(args.seed)
+            file = os.path.join(directory, "generated" + args.format)
+            writeProject(generate_project(args.items, args.layers, args.mix, args.variants), file)
+        output = os.path.join(directory, "written" + (args.format if not args.file else os.path.splitext(file)[1]))
+
+        phases = {name: Phase(name, args.trace_memory) for name in ('parse', 'materialize', 'getData', 'dump')}
+
+        def materialize():
+            # What CDProjectLoader does, without handing control back to the event loop in between
+            for layer, content in project.loadProject(data):
+                project.updateSnaps(layer.loadItems(content))
+
+        data = phases['parse'].run(lambda: readProject(file), args.repeat)
+        items = sum(len(layer['content']['items']) for layer in data['layers'])
+        phases['materialize'].run(materialize, args.repeat, setup=project.project_new)
+        data = phases['getData'].run(project.getData, args.repeat)
+        serializer = serializerForFile(output)
+        phases['dump'].run(lambda: serializer.dump(data, output), args.repeat)
+
+        window.close()
+        del app
+
+    results = {'file': args.file or f"generated {args.format}", 'items': items,
+               'phases': {name: phase.results(items) for name, phase in phases.items()}}
+
+    print(f"{items} items from {results['file']}, best of {args.repeat}")
+    # Python allocations are traced per phase, the resident memory is the peak of the process up to the end of the phase
+    print(f"  {'phase':<12}{'time':>10}{'items/s':>12}{'traced':>10}{'proc peak':>10}")
+    for name, phase in results['phases'].items():
+        traced = f"{phase['traced_mb']:8.1f}MB" if phase['traced_mb'] is not None else f"{'-':>10}"
+        rss = f"{phase['process_peak_rss_mb']:8.0f}MB" if phase['process_peak_rss_mb'] is not None else f"{'-':>10}"
+        print(f"  {name:<12}{1000 * phase['seconds']:8.0f}ms{phase['items_per_second']:12.0f}{traced}{rss}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for name, phase in results['phases'].items():
+            before = baseline['phases'].get(name)
+            if before and phase['items_per_second'] < before['items_per_second'] * (1 - args.tolerance):
+                regressions.append(name)
+                print(f"  {name} regressed: {phase['items_per_second']:.0f} items/s, "
+                      f"was {before['items_per_second']:.0f} items/s")
+
+        if regressions:
+            sys.exit(1)
+        print("  no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Compares the project file formats on a generated chip: time to write and read the file, and its size.
+#
+#   python -m benchmarks.bench_serializers --items 50000 --layers 2
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.generate_project import generate_project
+from cdproject.serializers import SERIALIZERS
+
+
+def measure(function, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark project file formats")
+    parser.add_argument("--items", type=int, default=50000, help="number of blocks on the chip")
+    parser.add_argument("--layers", type=int, default=2, help="number of layers the blocks are spread over")
+    parser.add_argument("--repeat", type=int, default=3, help="the best of this many runs is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    data = generate_project(args.items, args.layers)
+
+    print(f"{args.items} items on {args.layers} layers")
+    print(f"  {'format':<34}{'write':>10}{'read':>10}{'size':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for serializer in SERIALIZERS:
+            file = os.path.join(directory, "project" + serializer.extension)
+
+            write, _ = measure(lambda: serializer.dump(data, file), args.repeat)
+            read, loaded = measure(lambda: serializer.load(file), args.repeat)
+            size = os.path.getsize(file)
+
+            check = "" if loaded == data else "  (does not read back the same)"
+            print(f"  {serializer.name:<34}{1000 * write:8.0f}ms{1000 * read:8.0f}ms{size / 2 ** 20:10.1f}MB{check}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Compares the scalar (grid walk) and the vectorized (NumPy) snap matching of CDSnapIndex on a synthetic chip.
+#
+#   python -m benchmarks.bench_snapping --items 5000 --points 2
+import argparse
+import random
+import time
+
+from cdproject.snapindex import CDSnapIndex
+
+
+def build_index(items, width, height, cell):
+    index = CDSnapIndex(cell)
+    for i in range(items):
+        x, y = random.uniform(0, width), random.uniform(0, height)
+        # Every block has two snap points, roughly a block length apart
+        index.set(i, [(x, y), (x + random.uniform(-2, 2), y + random.uniform(-2, 2))])
+    return index
+
+
+def run(method, queries, dist, exclude):
+    start = time.perf_counter()
+    for points in queries:
+        method(points, dist, exclude)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark snap matching")
+    parser.add_argument("--items", type=int, default=5000, help="number of blocks on the chip")
+    parser.add_argument("--points", type=int, default=2, help="number of snap points being dragged")
+    parser.add_argument("--queries", type=int, default=200, help="number of simulated mouse moves")
+    parser.add_argument("--dist", type=float, default=0.3, help="snap distance in scene units (mm)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    width, height = 20.0, 10.0
+
+    index = build_index(args.items, width, height, args.dist)
+    queries = [[(random.uniform(0, width), random.uniform(0, height)) for _ in range(args.points)]
+               for _ in range(args.queries)]
+    exclude = set(random.sample(range(args.items), min(args.points // 2, args.items)))
+
+    # Build the contiguous array up front, as happens once at the start of a drag
+    index.candidatesVectorized(queries[0], args.dist, exclude)
+
+    scalar = run(index.candidates, queries, args.dist, exclude)
+    vectorized = run(index.candidatesVectorized, queries, args.dist, exclude)
+
+    print(f"{args.items} items, {args.points} points, {args.queries} queries")
+    print(f"  scalar:     {1000 * scalar / args.queries:8.3f} ms/query")
+    print(f"  vectorized: {1000 * vectorized / args.queries:8.3f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
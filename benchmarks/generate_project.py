@@ -0,0 +1,90 @@
+# Writes a synthetic project with any number of layers and blocks, in any of the project formats.
+#
+#   python -m benchmarks.generate_project large.cdp --items 100000 --layers 4 --mix straight=4,bend=2,taper=1,s-bend=1
+#
+# Real chips repeat a few block shapes many times, so by default the blocks of every type come in a limited number of
+# variants (parameter sets). With --variants 0 every block has a shape of its own.
+import argparse
+import random
+
+from cdproject.projectfile import writeProject
+
+TYPES = {
+    'straight': ('Straight', ('length',)),
+    'bend': ('Bend', ('radius',)),
+    'taper': ('Taper', ('width2', 'length')),
+    's-bend': ('S-Bend', ('length', 'side'))
+}
+
+DEFAULT_MIX = {kind: 1 for kind in TYPES}
+DEFAULT_VARIANTS = 20
+
+
+def parse_mix(text):
+    # "straight=4,bend=2" gives the relative number of blocks of every type
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in TYPES:
+            raise argparse.ArgumentTypeError(f"unknown block type {kind}, choose from {', '.join(TYPES)}")
+        mix[kind] = float(weight) if weight else 1.0
+    return mix
+
+
+def generate_params(kind):
+    params = {'width': round(random.uniform(0.1, 1.0), 3)}
+    for param in TYPES[kind][1]:
+        params[param] = round(random.uniform(0.5, 5.0), 3)
+    return params
+
+
+def generate_item(kind, width, height, variants=None):
+    params = random.choice(variants[kind]) if variants else generate_params(kind)
+
+    angle = random.choice([(1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)])
+    return {'name': TYPES[kind][0], 'type': kind, **params,
+            'position': {'x': random.uniform(0, width), 'y': random.uniform(0, height)},
+            'transformation': [angle[0], angle[1], 0.0, -angle[1], angle[0], 0.0, 0.0, 0.0, 1.0]}
+
+
+def generate_project(items, layers, mix=None, variants=DEFAULT_VARIANTS, width=20.0, height=10.0):
+    # The same data that CDProject.getData gives for a chip with the items spread evenly over the layers
+    mix = mix or DEFAULT_MIX
+    kinds, weights = list(mix), list(mix.values())
+    variants = {kind: [generate_params(kind) for _ in range(variants)] for kind in kinds} if variants else None
+
+    return {
+        'theme': 'Default',
+        'cells': [],
+        'layers': [
+            {
+                'position': i,
+                'content': {'name': f"Layer {i + 1}", 'visible': True, 'substrate': i == 0, 'thickness': 0.5,
+                            'material': 'Nitride', 'background_material': 'Glass',
+                            'items': [generate_item(kind, width, height, variants)
+                                      for kind in random.choices(kinds, weights, k=items // layers +
+                                                                 (i < items % layers))]}
+            } for i in range(layers)
+        ]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Chip Drawer project")
+    parser.add_argument("file", help="project to write, the extension selects the format")
+    parser.add_argument("--items", type=int, default=10000, help="number of blocks on the chip")
+    parser.add_argument("--layers", type=int, default=2, help="number of layers the blocks are spread over")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="relative number of blocks per type, for example straight=4,bend=1")
+    parser.add_argument("--variants", type=int, default=DEFAULT_VARIANTS,
+                        help="number of distinct shapes per block type, 0 for a shape per block")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    writeProject(generate_project(args.items, args.layers, args.mix, args.variants), args.file)
+    print(f"Wrote {args.items} items on {args.layers} layers to {args.file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ from github import Github, RateLimitExceededException
 from yaml import load
 
 from buildingblocks.blocks import CDBlockBend, CDBlockSBend, CDBlockStraight, CDBlockTaper
+from buildingblocks.cells import CDCellInstance
 
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -19,7 +20,8 @@ BLOCKITEMS = {
     'straight': CDBlockStraight,
     'bend': CDBlockBend,
     'taper': CDBlockTaper,
-    's-bend': CDBlockSBend
+    's-bend': CDBlockSBend,
+    'instance': CDCellInstance
 }
 
 
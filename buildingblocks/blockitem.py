@@ -1,17 +1,91 @@
 import math
 import typing
+from collections import OrderedDict
+from contextlib import contextmanager
 
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QBrush, QPainter, QPainterPath, QPen, QTransform
+from PyQt6.QtCore import QPointF, Qt
+from PyQt6.QtGui import QBrush, QPainter, QPainterPath, QPen, QPolygonF, QTransform
 from PyQt6.QtWidgets import QGraphicsPathItem, QStyleOptionGraphicsItem, QWidget
 
+from buildingblocks import geometry
+
 SNAP_MAX = 1e6
 
 DEFAULT_WIDTH = 0.2
-SQRT_2 = math.sqrt(2)
+
+# Handle size in scene units for items that are not shown in a view
+DEFAULT_HANDLE_SIZE = 0.02
+
+# Number of distinct block shapes kept in the geometry cache
+GEOMETRY_CACHE_SIZE = 4096
+
+# Largest deviation of the simplified outline that is painted for small items, relative to the size of the item
+LOD_TOLERANCE = 0.02
+FLATTEN_SCALE = 1000
+
+
+class CDBlockGeometry:
+    # Geometry shared by all blocks with the same type and parameters. QPainterPath is implicitly shared, so every item
+    # that sets this path refers to the same data.
+    def __init__(self, path, snaps, simplified=None):
+        self.path = path
+        self.snaps = tuple(snaps)
+
+        # Coarse outline that is painted instead of the path when the item is small on screen
+        self.simplified = simplified if simplified is not None else simplifyPath(path, LOD_TOLERANCE)
+
+        # Convex polygon around the shape for hit testing. The path is the polygon of the geometry kernel, with arcs and
+        # curves already discretized, so the hull of its points encloses the whole shape.
+        self.hull = QPainterPath()
+        self.hull.addPolygon(convexHull([(e.x, e.y) for e in (path.elementAt(i) for i in range(path.elementCount()))]))
+        self.hull.closeSubpath()
+        self.hull_rect = self.hull.boundingRect()
+
+    @classmethod
+    def fromOutline(cls, outline, ports):
+        # Builds the Qt geometry from the outline and ports of the geometry kernel
+        path = QPainterPath()
+        path.addPolygon(QPolygonF([QPointF(x, y) for x, y in outline.tolist()]))
+        path.closeSubpath()
+        return cls(path, [QPointF(x, y) for x, y in ports.tolist()])
+
+
+class CDGeometryCache:
+    # Least recently used cache of block geometry, keyed by block type and parameter values
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get(self, key, build):
+        geometry = self._entries.get(key)
+        if geometry is None:
+            geometry = build()
+            self._entries[key] = geometry
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+
+        return geometry
+
+
+geometry_cache = CDGeometryCache(GEOMETRY_CACHE_SIZE)
 
 
 class CDBlockItem(QGraphicsPathItem):
+    # Names of the parameters that define the shape, in the order the constructor takes them
+    PARAMS = ()
+
+    # Below these on-screen sizes (in pixels), items are painted as a simplified outline or as a filled box
+    lod_simplified = 24.0
+    lod_box = 4.0
+
     def __init__(self):
         super().__init__()
         self.setAcceptHoverEvents(True)
@@ -20,6 +94,42 @@ class CDBlockItem(QGraphicsPathItem):
         self.setPen(QPen(Qt.PenStyle.NoPen))
 
         self._snaps = []
+        self.geometry = None
+
+        self._batch = 0
+        self._dirty = False
+
+        self.journal_key = None
+
+    @classmethod
+    def fromData(cls, data, cells=None):
+        item = cls(*(data[p] for p in cls.PARAMS))
+        item.setPos(QPointF(data['position']['x'], data['position']['y']))
+        item.setTransform(array2transform(data['transformation']))
+        return item
+
+    @contextmanager
+    def batchUpdate(self):
+        # Parameter changes within the batch only rebuild the path once, when the outermost batch ends
+        self._batch += 1
+        try:
+            yield self
+        finally:
+            self._batch -= 1
+            if not self._batch and self._dirty:
+                self.updatePath()
+
+    def setParams(self, **params):
+        with self.batchUpdate():
+            for name, value in params.items():
+                setattr(self, name, value)
+
+    def updatePath(self):
+        if self._batch:
+            self._dirty = True
+        else:
+            self._dirty = False
+            self.createPath()
 
     def setRotation(self, angle: float) -> None:
         self.setTransform(self.transform().rotate(angle))
@@ -41,25 +151,92 @@ class CDBlockItem(QGraphicsPathItem):
     def snapTo(self, index, t, point):
         self.setPos(point - self.transform().map(self._snaps[index]))
 
+    def handleSize(self):
+        # Handles have a fixed size on screen. The view keeps track of what that is in scene units, so items never have
+        # to look up windows or screens themselves.
+        views = self.scene().views() if self.scene() else []
+        return views[0].handle_size if views else DEFAULT_HANDLE_SIZE
+
+    def copy(self):
+        # The constructor takes all parameters at once, so the copy only builds its path once
+        b = type(self)(*(getattr(self, p) for p in self.PARAMS))
+        b.setBrush(self.brush())
+        b.setPos(self.pos())
+        b.setTransform(self.transform())
+        b.setFlags(self.flags())
+        return b
+
     def shape(self) -> QPainterPath:
         return self.path()
 
+    def collidesWithPath(self, path: QPainterPath,
+                         mode: Qt.ItemSelectionMode = Qt.ItemSelectionMode.IntersectsItemShape) -> bool:
+        # Most items are either far outside or completely inside a selection area. Those are decided on the bounding
+        # box and the hull alone, only the items on the border of the area are tested against the curved path.
+        if not self.geometry or mode not in (Qt.ItemSelectionMode.ContainsItemShape,
+                                             Qt.ItemSelectionMode.IntersectsItemShape):
+            return super().collidesWithPath(path, mode)
+
+        hull = self.geometry.hull
+        bounds = path.boundingRect()
+        if not bounds.intersects(self.geometry.hull_rect):
+            return False
+        if path.contains(hull):
+            return True
+        if not path.intersects(hull):
+            return False
+
+        return super().collidesWithPath(path, mode)
+
+    def params(self):
+        return tuple(getattr(self, p) for p in self.PARAMS)
+
     def createPath(self):
+        # The chord error is part of the key, so changing it never returns geometry discretized for another tolerance
+        self.geometry = geometry_cache.get((type(self), geometry.chord_error) + self.params(), self.buildGeometry)
+        self.snaps = self.geometry.snaps
+        self.setPath(self.geometry.path)
+
+    def buildGeometry(self):
         raise NotImplementedError
 
     def getData(self):
         raise NotImplementedError
 
+    def flatData(self):
+        # Data of the plain blocks this item consists of
+        return [self.getData()]
+
+    def loadData(self, data):
+        # TODO: Implement name
+        self.setParams(**{p: data[p] for p in self.PARAMS})
+        self.setPos(QPointF(data['position']['x'], data['position']['y']))
+        self.setTransform(array2transform(data['transformation']))
+
     def paint(self, painter: QPainter, option: 'QStyleOptionGraphicsItem',
               widget: typing.Optional[QWidget] = ...) -> None:
+        rect = self.boundingRect()
+        size = max(rect.width(), rect.height()) * option.levelOfDetailFromTransform(painter.worldTransform())
+
+        if size < self.lod_box:
+            painter.fillRect(rect, self.brush())
+            # The item is only a few pixels on screen, so the selection is drawn with a cosmetic pen to stay visible
+            if self.isSelected():
+                painter.setBrush(QBrush(Qt.BrushStyle.NoBrush))
+                painter.setPen(QPen(Qt.GlobalColor.black, 0, Qt.PenStyle.DashLine))
+                painter.drawRect(rect)
+            return
+
+        path = self.path() if size >= self.lod_simplified or not self.geometry else self.geometry.simplified
+
         painter.setBrush(self.brush())
         painter.setPen(self.pen())
-        painter.drawPath(self.path())
+        painter.drawPath(path)
 
         if self.isSelected():
             painter.setBrush((QBrush(Qt.BrushStyle.NoBrush)))
             painter.setPen(QPen(Qt.GlobalColor.black, 0.04, Qt.PenStyle.DashLine))
-            painter.drawPath(self.path())
+            painter.drawPath(path)
 
             # TODO: Paint handles for resizing etc.
 
@@ -71,6 +248,66 @@ class CDBlockItem(QGraphicsPathItem):
             self.setTransform(t.scale(1, -1))
 
 
+def simplifyPath(path: QPainterPath, tolerance):
+    # Flattens the path finely and then drops every vertex that lies within the tolerance (a fraction of the size of the
+    # shape) of the simplified outline, using Douglas-Peucker. Painted at the simplified level of detail, the difference
+    # stays below a pixel.
+    rect = path.boundingRect()
+    scale = FLATTEN_SCALE / max(rect.width(), rect.height(), 1e-9)
+    polygon = path.toFillPolygon(QTransform.fromScale(scale, scale))
+    points = [(p.x() / scale, p.y() / scale) for p in polygon]
+    if len(points) < 4:
+        return path
+
+    tolerance = tolerance * max(rect.width(), rect.height())
+    keep = {0, len(points) - 1}
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        length = math.hypot(x2 - x1, y2 - y1)
+
+        farthest, distance = None, tolerance
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if length:
+                d = abs((x2 - x1) * (y1 - y) - (x1 - x) * (y2 - y1)) / length
+            else:
+                d = math.hypot(x - x1, y - y1)
+            if d > distance:
+                farthest, distance = i, d
+
+        if farthest is not None:
+            keep.add(farthest)
+            stack += [(first, farthest), (farthest, last)]
+
+    if len(keep) == len(points):
+        return path
+
+    simplified = QPainterPath()
+    simplified.addPolygon(QPolygonF([QPointF(*points[i]) for i in sorted(keep)]))
+    simplified.closeSubpath()
+    return simplified
+
+
+def convexHull(points):
+    # Monotone chain, returns the hull in counter-clockwise order
+    points = sorted(set(points))
+    if len(points) < 3:
+        return QPolygonF([QPointF(*p) for p in points])
+
+    def half(points):
+        chain = []
+        for p in points:
+            while len(chain) >= 2 and ((chain[-1][0] - chain[-2][0]) * (p[1] - chain[-2][1]) -
+                                       (chain[-1][1] - chain[-2][1]) * (p[0] - chain[-2][0])) <= 0:
+                chain.pop()
+            chain.append(p)
+        return chain[:-1]
+
+    return QPolygonF([QPointF(*p) for p in half(points) + half(reversed(points))])
+
+
 def transform2array(t: QTransform):
     return [t.m11(), t.m12(), t.m13(), t.m21(), t.m22(), t.m23(), t.m31(), t.m32(), t.m33()]
 
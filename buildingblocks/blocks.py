@@ -1,8 +1,7 @@
-from PyQt6.QtCore import QPoint, QPointF, QRectF, Qt
-from PyQt6.QtGui import QPainterPath
-from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QRectF, Qt
 
-from buildingblocks.blockitem import CDBlockItem, DEFAULT_WIDTH, SQRT_2, array2transform, transform2array
+from buildingblocks import geometry
+from buildingblocks.blockitem import CDBlockGeometry, CDBlockItem, DEFAULT_WIDTH, transform2array
 
 
 # TODO: Make pen size and handle size dependent on pixels, not on the scene coordinates
@@ -11,6 +10,7 @@ from buildingblocks.blockitem import CDBlockItem, DEFAULT_WIDTH, SQRT_2, array2t
 
 
 class CDBlockStraight(CDBlockItem):
+    PARAMS = ('width', 'length')
     DEFAULT_LENGTH = 2.0
 
     def __init__(self, w=None, l=None):
@@ -21,7 +21,6 @@ class CDBlockStraight(CDBlockItem):
 
         self.snaps = []
 
-        self.handles = []
         self.handleSelected = None
 
         self.createPath()
@@ -33,7 +32,7 @@ class CDBlockStraight(CDBlockItem):
     @width.setter
     def width(self, w):
         self._width = w
-        self.createPath()
+        self.updatePath()
 
     @property
     def length(self):
@@ -42,45 +41,26 @@ class CDBlockStraight(CDBlockItem):
     @length.setter
     def length(self, l):
         self._length = l
-        self.createPath()
+        self.updatePath()
 
     def rescale(self, scale: float) -> None:
         self._length = self._length * scale
-        self.createPath()
-
-    def createPath(self):
-        self.snaps = [QPointF(-self._length / 2, 0), QPointF(self._length / 2, 0)]
+        self.updatePath()
 
-        p = QPainterPath()
-        p.addRect(-self._length / 2, -self._width / 2, self._length, self._width)
+    def buildGeometry(self):
+        return CDBlockGeometry.fromOutline(*geometry.straight(self._width, self._length))
 
-        self.setPath(p)
-
-        # Now also update the handles
-        try:
-            dpi = QApplication.instance().activeWindow().screen().physicalDotsPerInch()
-            # lasjdfljkasdl
-            # TODO: Implement this in the right way!
-            hsize = QApplication.instance().activeWindow().drawing_area.mapToScene(
-                QPoint(int(dpi * 0.01 / 25.4), 0)).x()  # 25.4 mm/inch
-        except AttributeError:
-            hsize = 0.02
+    @property
+    def handles(self):
+        hsize = self.handleSize()
 
-        self.handles = [
+        return [
             (Qt.CursorShape.SizeHorCursor if self.rotation() % 180 == 0 else Qt.CursorShape.SizeVerCursor,
              QRectF(-self._length / 2 - hsize / 2, -hsize / 2, hsize, hsize)),
             (Qt.CursorShape.SizeHorCursor if self.rotation() % 180 == 0 else Qt.CursorShape.SizeVerCursor,
              QRectF(self._length / 2 - hsize / 2, -hsize / 2, hsize, hsize))
         ]
 
-    def copy(self):
-        b = CDBlockStraight(self._width, self._length)
-        b.setBrush(self.brush())
-        b.setPos(self.pos())
-        b.setTransform(self.transform())
-        b.setFlags(self.flags())
-        return b
-
     # # TODO: Stuff to implement to allow resizing
     # def paint(self, painter: QPainter, option: 'QStyleOptionGraphicsItem',
     #           widget: typing.Optional[QWidget] = ...) -> None:
@@ -162,15 +142,9 @@ class CDBlockStraight(CDBlockItem):
             'transformation': transform2array(self.transform())
         }
 
-    def loadData(self, data):
-        # TODO: Implement name
-        self.width = data['width']
-        self.length = data['length']
-        self.setPos(QPointF(data['position']['x'], data['position']['y']))
-        self.setTransform(array2transform(data['transformation']))
-
 
 class CDBlockBend(CDBlockItem):
+    PARAMS = ('width', 'radius')
     DEFAULT_RADIUS = 3.0
 
     def __init__(self, w=None, r=None):
@@ -190,7 +164,7 @@ class CDBlockBend(CDBlockItem):
     @width.setter
     def width(self, w):
         self._width = w
-        self.createPath()
+        self.updatePath()
 
     @property
     def radius(self):
@@ -199,36 +173,14 @@ class CDBlockBend(CDBlockItem):
     @radius.setter
     def radius(self, r):
         self._radius = r
-        self.createPath()
+        self.updatePath()
 
     def rescale(self, scale: float) -> None:
         self._radius = self._radius * scale
-        self.createPath()
-
-    def createPath(self):
-        center = QPointF(-self._radius / SQRT_2, -self._radius / SQRT_2)
-
-        p = QPainterPath()
-        p.moveTo(center.x() + (self._radius - self._width / 2), center.y())
-        p.arcTo(center.x() - (self._radius - self._width / 2), center.y() - (self._radius - self._width / 2),
-                2 * (self._radius - self._width / 2), 2 * (self._radius - self._width / 2), 0, -90)
-        p.lineTo(center.x(), center.y() + self._radius + self._width / 2)
-        p.arcTo(center.x() - (self._radius + self._width / 2), center.y() - (self._radius + self._width / 2),
-                2 * (self._radius + self._width / 2), 2 * (self._radius + self._width / 2), -90, 90)
-        p.lineTo(center.x() + (self._radius - self._width / 2), center.y())
-
-        self.snaps = [QPointF(center.x() + self._radius, center.y()),
-                      QPointF(center.x(), center.y() + self._radius)]
-
-        self.setPath(p)
+        self.updatePath()
 
-    def copy(self):
-        b = CDBlockBend(self._width, self._radius)
-        b.setBrush(self.brush())
-        b.setPos(self.pos())
-        b.setTransform(self.transform())
-        b.setFlags(self.flags())
-        return b
+    def buildGeometry(self):
+        return CDBlockGeometry.fromOutline(*geometry.bend(self._width, self._radius))
 
     # TODO: Support to name the data blocks
     def getData(self):
@@ -244,15 +196,9 @@ class CDBlockBend(CDBlockItem):
             'transformation': transform2array(self.transform())
         }
 
-    def loadData(self, data):
-        # TODO: Implement name
-        self.width = data['width']
-        self.radius = data['radius']
-        self.setPos(QPointF(data['position']['x'], data['position']['y']))
-        self.setTransform(array2transform(data['transformation']))
-
 
 class CDBlockTaper(CDBlockItem):
+    PARAMS = ('width', 'width2', 'length')
     DEFAULT_LENGTH = 2.0
 
     def __init__(self, w1=None, w2=None, l=None):
@@ -273,7 +219,7 @@ class CDBlockTaper(CDBlockItem):
     @width.setter
     def width(self, w1):
         self._width = w1
-        self.createPath()
+        self.updatePath()
 
     @property
     def width2(self):
@@ -282,7 +228,7 @@ class CDBlockTaper(CDBlockItem):
     @width2.setter
     def width2(self, w2):
         self._width2 = w2
-        self.createPath()
+        self.updatePath()
 
     @property
     def length(self):
@@ -291,31 +237,14 @@ class CDBlockTaper(CDBlockItem):
     @length.setter
     def length(self, l):
         self._length = l
-        self.createPath()
+        self.updatePath()
 
     def rescale(self, scale: float) -> None:
         self._length = self._length * scale
-        self.createPath()
-
-    def createPath(self):
-        self.snaps = [QPointF(-self._length / 2, 0), QPointF(self._length / 2, 0)]
-
-        p = QPainterPath()
-        p.moveTo(-self._length / 2, -self._width / 2)
-        p.lineTo(self._length / 2, -self._width2 / 2)
-        p.lineTo(self._length / 2, self._width2 / 2)
-        p.lineTo(-self._length / 2, self._width / 2)
-        p.lineTo(-self._length / 2, -self._width / 2)
+        self.updatePath()
 
-        self.setPath(p)
-
-    def copy(self):
-        b = CDBlockTaper(self._width, self._width2, self._length)
-        b.setBrush(self.brush())
-        b.setPos(self.pos())
-        b.setTransform(self.transform())
-        b.setFlags(self.flags())
-        return b
+    def buildGeometry(self):
+        return CDBlockGeometry.fromOutline(*geometry.taper(self._width, self._width2, self._length))
 
     # TODO: Support to name the data blocks
     def getData(self):
@@ -332,16 +261,9 @@ class CDBlockTaper(CDBlockItem):
             'transformation': transform2array(self.transform())
         }
 
-    def loadData(self, data):
-        # TODO: Implement name
-        self.width = data['width']
-        self.width2 = data['width2']
-        self.length = data['length']
-        self.setPos(QPointF(data['position']['x'], data['position']['y']))
-        self.setTransform(array2transform(data['transformation']))
-
 
 class CDBlockSBend(CDBlockItem):
+    PARAMS = ('width', 'length', 'side')
     DEFAULT_LENGTH = 2.0
     DEFAULT_SIDE = 1.0
 
@@ -363,7 +285,7 @@ class CDBlockSBend(CDBlockItem):
     @width.setter
     def width(self, w):
         self._width = w
-        self.createPath()
+        self.updatePath()
 
     @property
     def side(self):
@@ -372,7 +294,7 @@ class CDBlockSBend(CDBlockItem):
     @side.setter
     def side(self, s):
         self._side = s
-        self.createPath()
+        self.updatePath()
 
     @property
     def length(self):
@@ -381,36 +303,14 @@ class CDBlockSBend(CDBlockItem):
     @length.setter
     def length(self, l):
         self._length = l
-        self.createPath()
+        self.updatePath()
 
     def rescale(self, scale: float) -> None:
         self._length = self._length * scale
-        self.createPath()
+        self.updatePath()
 
-    def createPath(self):
-        self.snaps = [QPointF(-self._length / 2, -self._side / 2), QPointF(self._length / 2, self._side / 2)]
-
-        p = QPainterPath()
-        # TODO: Find a better method than the /3 for the control points
-        p.moveTo(-self._length / 2, -self._side / 2 - self._width / 2)
-        p.cubicTo(QPointF(self._width / 3, -self._side / 2 - self._width / 2),
-                  QPointF(self._width / 3, self._side / 2 - self._width / 2),
-                  QPointF(self._length / 2, self._side / 2 - self._width / 2))
-        p.lineTo(QPointF(self._length / 2, self._side / 2 + self._width / 2))
-        p.cubicTo(QPointF(-self._width / 3, self._side / 2 + self._width / 2),
-                  QPointF(-self._width / 3, -self._side / 2 + self._width / 2),
-                  QPointF(-self._length / 2, -self._side / 2 + self._width / 2))
-        p.lineTo(QPointF(-self._length / 2, -self._side / 2 - self._width / 2))
-
-        self.setPath(p)
-
-    def copy(self):
-        b = CDBlockSBend(self._width, self._length, self._side)
-        b.setBrush(self.brush())
-        b.setPos(self.pos())
-        b.setTransform(self.transform())
-        b.setFlags(self.flags())
-        return b
+    def buildGeometry(self):
+        return CDBlockGeometry.fromOutline(*geometry.sbend(self._width, self._length, self._side))
 
     # TODO: Support to name the data blocks
     def getData(self):
@@ -426,11 +326,3 @@ class CDBlockSBend(CDBlockItem):
             },
             'transformation': transform2array(self.transform())
         }
-
-    def loadData(self, data):
-        # TODO: Implement name
-        self.width = data['width']
-        self.side = data['side']
-        self.length = data['length']
-        self.setPos(QPointF(data['position']['x'], data['position']['y']))
-        self.setTransform(array2transform(data['transformation']))
@@ -0,0 +1,135 @@
+import numpy as np
+from PyQt6.QtCore import QPointF, Qt
+from PyQt6.QtGui import QPainterPath, QPolygonF
+
+from buildingblocks import geometry
+from buildingblocks.blockitem import CDBlockGeometry, CDBlockItem, LOD_TOLERANCE, array2transform, simplifyPath, \
+    transform2array
+
+# Ports closer together than this (in mm) are connected to each other
+PORT_TOLERANCE = 1e-9
+
+
+class CDCell:
+    # A named group of blocks that is defined once and placed many times. The blocks are kept as their saved data, in
+    # the coordinates of the cell and grouped by the name of the layer they belong to (a part of the cell), so that
+    # layers can be added, moved and removed without the parts changing layer. The geometry of every part is built once
+    # and shared by all instances.
+    def __init__(self, name, parts):
+        self.name = name
+        self.parts = parts
+
+        self._geometry = {}
+
+    @classmethod
+    def fromData(cls, data):
+        return cls(data['name'], {layer['layer']: layer['items'] for layer in data['layers']})
+
+    def getData(self):
+        return {
+            'name': self.name,
+            'layers': [{'layer': layer, 'items': items} for layer, items in self.parts.items()]
+        }
+
+    def partGeometry(self, part=None):
+        # Geometry of one part, or of all parts together when the cell is being placed
+        key = (part, geometry.chord_error)
+        if key not in self._geometry:
+            self._geometry[key] = self.buildGeometry(part)
+        return self._geometry[key]
+
+    def buildGeometry(self, part):
+        items = self.parts[part] if part is not None else [item for items in self.parts.values() for item in items]
+
+        path = QPainterPath()
+        path.setFillRule(Qt.FillRule.WindingFill)
+        simplified = QPainterPath()
+        simplified.setFillRule(Qt.FillRule.WindingFill)
+
+        ports = []
+        for data in items:
+            outline, p = geometry.chipGeometry(data)
+            block = QPainterPath()
+            block.addPolygon(QPolygonF([QPointF(x, y) for x, y in outline.tolist()]))
+            block.closeSubpath()
+
+            path.addPath(block)
+            simplified.addPath(simplifyPath(block, LOD_TOLERANCE))
+            ports.append(p)
+
+        return CDBlockGeometry(path, [QPointF(x, y) for x, y in openPorts(ports).tolist()], simplified)
+
+    def expand(self, data):
+        # Data of the blocks of a placed part in chip coordinates, for code that only knows about blocks
+        matrix = geometry.dataTransform(data)
+
+        expanded = []
+        for item in self.parts[data['part']]:
+            m = geometry.dataTransform(item) @ matrix
+            position = {'x': float(m[2, 0]), 'y': float(m[2, 1])}
+            m[2, :2] = 0
+            expanded.append(dict(item, position=position, transformation=m.flatten().tolist()))
+
+        return expanded
+
+
+def openPorts(ports):
+    # Ports that are not connected to another port of the same cell, which are the ones other blocks can snap to
+    ports = np.concatenate(ports) if ports else np.empty((0, 2))
+    keys = np.round(ports / PORT_TOLERANCE).astype(np.int64)
+    _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    return ports[counts[inverse.reshape(-1)] == 1]
+
+
+class CDCellInstance(CDBlockItem):
+    # A part of a cell placed on a layer. Placing a cell puts one instance on every layer the cell has blocks in.
+    PARAMS = ('cell', 'part')
+
+    def __init__(self, cell, part=None):
+        super().__init__()
+
+        self._cell = cell
+        self._part = part
+
+        self.createPath()
+
+    @classmethod
+    def fromData(cls, data, cells=None):
+        item = cls(cells[data['cell']], data['part'])
+        item.setPos(QPointF(data['position']['x'], data['position']['y']))
+        item.setTransform(array2transform(data['transformation']))
+        return item
+
+    @property
+    def cell(self):
+        return self._cell
+
+    @property
+    def part(self):
+        return self._part
+
+    def createPath(self):
+        self.geometry = self._cell.partGeometry(self._part)
+        self.snaps = self.geometry.snaps
+        self.setPath(self.geometry.path)
+
+    def getData(self):
+        return {
+            'name': self._cell.name,
+            'type': 'instance',
+            'cell': self._cell.name,
+            'part': self._part,
+            'position': {
+                'x': self.pos().x(),
+                'y': self.pos().y()
+            },
+            'transformation': transform2array(self.transform())
+        }
+
+    def loadData(self, data):
+        # The cell and part of an instance never change, only where it is placed
+        self.setPos(QPointF(data['position']['x'], data['position']['y']))
+        self.setTransform(array2transform(data['transformation']))
+
+    def flatData(self):
+        return self._cell.expand(self.getData())
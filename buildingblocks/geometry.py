@@ -0,0 +1,165 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+# Largest distance (in mm) between a curve and the straight segments it is discretized into
+DEFAULT_CHORD_ERROR = 1e-3
+MAX_SEGMENTS = 1024
+
+SQRT_2 = math.sqrt(2)
+
+chord_error = DEFAULT_CHORD_ERROR
+
+# Geometry of all building blocks, independent of Qt. Every block type maps its parameters to an outline and a list of
+# ports, both in the local coordinates of the block. Outlines are (N, 2) float64 arrays of the polygon vertices in
+# order, without repeating the first vertex at the end. Ports are (P, 2) arrays with the points other blocks snap to.
+
+
+def setChordError(tolerance):
+    global chord_error
+    if tolerance > 0:
+        chord_error = tolerance
+
+
+def arcSegments(radius, angle, tolerance=None):
+    # A chord over an angle a deviates r * (1 - cos(a / 2)) from its arc
+    tolerance = tolerance or chord_error
+    if radius <= tolerance:
+        return 1
+    return min(max(math.ceil(angle / (2 * math.acos(1 - tolerance / radius))), 1), MAX_SEGMENTS)
+
+
+def cubicSegments(p0, p1, p2, p3, tolerance=None):
+    # Wang's formula: bounds the deviation of evenly spaced chords by the second differences of the control points
+    tolerance = tolerance or chord_error
+    p0, p1, p2, p3 = (np.asarray(p, dtype=np.float64) for p in (p0, p1, p2, p3))
+    m = max(np.hypot(*(p0 - 2 * p1 + p2)), np.hypot(*(p1 - 2 * p2 + p3)))
+    return min(max(math.ceil(math.sqrt(0.75 * m / tolerance)), 1), MAX_SEGMENTS)
+
+
+@lru_cache(maxsize=256)
+def arcTable(segments, angle):
+    # Unit circle samples from 0 to angle, shared by all arcs with the same number of segments
+    t = np.linspace(0, angle, segments + 1)
+    table = np.column_stack((np.cos(t), np.sin(t)))
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=256)
+def cubicTable(segments):
+    # Bernstein weights of the four control points at evenly spaced parameters
+    t = np.linspace(0, 1, segments + 1)
+    table = np.column_stack(((1 - t) ** 3, 3 * (1 - t) ** 2 * t, 3 * (1 - t) * t ** 2, t ** 3))
+    table.flags.writeable = False
+    return table
+
+
+def straight(width, length):
+    outline = np.array([(-length / 2, -width / 2), (length / 2, -width / 2),
+                        (length / 2, width / 2), (-length / 2, width / 2)])
+    ports = np.array([(-length / 2, 0), (length / 2, 0)])
+    return outline, ports
+
+
+def bend(width, radius):
+    center = np.array([-radius / SQRT_2, -radius / SQRT_2])
+
+    # Inner arc from the first port to the second, outer arc back again
+    inner = center + (radius - width / 2) * arcTable(arcSegments(radius - width / 2, math.pi / 2), math.pi / 2)
+    outer = center + (radius + width / 2) * arcTable(arcSegments(radius + width / 2, math.pi / 2), math.pi / 2)[::-1]
+
+    outline = np.concatenate((inner, outer))
+    ports = np.array([(center[0] + radius, center[1]), (center[0], center[1] + radius)])
+    return outline, ports
+
+
+def taper(width, width2, length):
+    outline = np.array([(-length / 2, -width / 2), (length / 2, -width2 / 2),
+                        (length / 2, width2 / 2), (-length / 2, width / 2)])
+    ports = np.array([(-length / 2, 0), (length / 2, 0)])
+    return outline, ports
+
+
+def sbend(width, length, side):
+    # TODO: Find a better method than the /3 for the control points
+    lower = cubic((-length / 2, -side / 2 - width / 2),
+                  (width / 3, -side / 2 - width / 2),
+                  (width / 3, side / 2 - width / 2),
+                  (length / 2, side / 2 - width / 2))
+    upper = cubic((length / 2, side / 2 + width / 2),
+                  (-width / 3, side / 2 + width / 2),
+                  (-width / 3, -side / 2 + width / 2),
+                  (-length / 2, -side / 2 + width / 2))
+
+    outline = np.concatenate((lower, upper))
+    ports = np.array([(-length / 2, -side / 2), (length / 2, side / 2)])
+    return outline, ports
+
+
+def cubic(p0, p1, p2, p3):
+    return cubicTable(cubicSegments(p0, p1, p2, p3)) @ np.array((p0, p1, p2, p3), dtype=np.float64)
+
+
+BLOCKS = {
+    'straight': (straight, ('width', 'length')),
+    'bend': (bend, ('width', 'radius')),
+    'taper': (taper, ('width', 'width2', 'length')),
+    's-bend': (sbend, ('width', 'length', 'side'))
+}
+
+
+def blockGeometry(data):
+    # Outline and ports in local coordinates for the saved data of a block
+    function, params = BLOCKS[data['type']]
+    outline, ports = function(*(data[p] for p in params))
+    return np.ascontiguousarray(outline), np.ascontiguousarray(ports)
+
+
+def dataTransform(data):
+    # Affine transformation from block to chip coordinates as a 3x3 matrix acting on row vectors, the same convention
+    # that QTransform uses. The position of the block is applied after its transformation.
+    matrix = np.array(data['transformation'], dtype=np.float64).reshape(3, 3)
+    matrix[2, :2] += (data['position']['x'], data['position']['y'])
+    return matrix
+
+
+def transformPoints(points, matrices):
+    # Maps (..., N, 2) points with (..., 3, 3) matrices, so that any number of blocks with outlines of the same size are
+    # transformed at once. Projective transformations are divided out.
+    points = np.asarray(points, dtype=np.float64)
+    matrices = np.asarray(matrices, dtype=np.float64)
+
+    mapped = points @ matrices[..., :2, :] + matrices[..., np.newaxis, 2, :]
+    return mapped[..., :2] / mapped[..., 2:]
+
+
+def chipGeometry(data):
+    # Outline and ports of a block in chip coordinates
+    outline, ports = blockGeometry(data)
+    matrix = dataTransform(data)
+    return transformPoints(outline, matrix), transformPoints(ports, matrix)
+
+
+def shapeKey(data):
+    # Blocks with the same key have the same outline in block coordinates
+    return data['type'], tuple(data[p] for p in BLOCKS[data['type']][1])
+
+
+@lru_cache(maxsize=4096)
+def _outline(key, tolerance):
+    outline = np.ascontiguousarray(BLOCKS[key[0]][0](*key[1])[0])
+    outline.flags.writeable = False
+    return outline
+
+
+def shapeOutline(key):
+    # Read-only outline in block coordinates, shared by all blocks with the same shape
+    return _outline(key, chord_error)
+
+
+def chipOutline(data):
+    # Outline of a block in chip coordinates, for exporting many blocks. The outline in block coordinates is shared by
+    # all blocks with the same shape, so only the transformation is computed for every block.
+    return transformPoints(shapeOutline(shapeKey(data)), dataTransform(data))
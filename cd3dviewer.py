@@ -1,10 +1,11 @@
+import numpy as np
 import pyvista as pv
 from PIL import Image
 from PyQt6.QtGui import QCloseEvent
-from PyQt6.QtWidgets import QDialog, QFileDialog, QFrame, QGraphicsRectItem, QVBoxLayout
+from PyQt6.QtWidgets import QDialog, QFileDialog, QFrame, QVBoxLayout
 from pyvistaqt import QtInteractor
 
-from buildingblocks.blockitem import SQRT_2
+from buildingblocks.geometry import chipOutline
 
 
 class CD3DViewer(QDialog):
@@ -30,6 +31,10 @@ class CD3DViewer(QDialog):
         # self.plotter.enable_eye_dome_lighting()
         vlayout.addWidget(self.plotter.interactor)
 
+        # Blocks that are picked in the viewer are selected in the drawing
+        self.items = []
+        self.plotter.enable_element_picking(callback=self.cellPicked, mode='cell', show=False)
+
         self.show()
 
         self.updateChip()
@@ -39,59 +44,28 @@ class CD3DViewer(QDialog):
         self.plotter.background_color = 'white'
         self.plotter.clear()
 
-        z_cur = 0
-
-        theme = self.project.theme
-
-        for layer in reversed(self.project.chip_layers):
-            props = layer.material.get3D()
-            bg_props = layer.background_material.get3D()
-
-            if layer.substrate:
-                c = pv.Cube((0, 0, z_cur + theme.substrate3d['thickness'] / 2),
-                            self.project.chip_width,
-                            self.project.chip_height,
-                            theme.substrate3d['thickness'])
-                self.plotter.add_mesh(c,
-                                      **{k: theme.substrate3d[k] for k in theme.substrate3d.keys() if k != "thickness"})
-
-                z_cur += theme.substrate3d['thickness']
-
-            c = pv.Cube((0, 0, z_cur + layer.thickness / 2), self.project.chip_width, self.project.chip_height,
-                        layer.thickness)
-            self.plotter.add_mesh(c, **bg_props)
-
-            for item in layer.childItems():
-                if type(item) is QGraphicsRectItem:
-                    continue
+        # The items in the order in which addChip numbers them
+        layers = [(layer, layer.blockItems()) for layer in reversed(self.project.chip_layers)]
+        self.items = [item for layer, items in layers for item in items]
 
-                info = item.getData()
+        addChip(self.plotter, self.project.theme,
+                ((layer.substrate, layer.thickness, layer.material, layer.background_material,
+                  [list(item.flatData()) for item in items]) for layer, items in layers),
+                self.project.chip_width, self.project.chip_height)
 
-                match info['type']:
-                    case 'straight':
-                        c = pv.Cube((0, 0, z_cur + layer.thickness / 2), item.width, item.length,
-                                    layer.thickness)
-                        c.rotate_z(item.rotation() - 90, inplace=True)
-                        c.translate(self.chiptrans(item.pos().x(), item.pos().y()), inplace=True)
-                        self.plotter.add_mesh(c, **props)
-                    case 'bend':
-                        r = pv.Rectangle([[0, item._radius - item._width / 2, z_cur],
-                                          [0, item._radius + item._width / 2, z_cur],
-                                          [0, item._radius + item._width / 2, z_cur + layer.thickness],
-                                          [0, item._radius - item._width / 2, z_cur + layer.thickness]])
-                        curve = r.extrude_rotate(resolution=40, angle=90, capping=True)
-                        curve.translate((item._radius / SQRT_2, -item._radius / SQRT_2, 0), inplace=True)
-                        curve.rotate_z(-item.rotation(), inplace=True)
-
-                        curve.translate(self.chiptrans(item.pos().x(), item.pos().y()), inplace=True)
-                        self.plotter.add_mesh(curve, **props)
+        self.plotter.update()
 
-            z_cur += layer.thickness
+    def cellPicked(self, cell):
+        if cell is None or 'item_id' not in cell.cell_data:
+            return
 
-        self.plotter.update()
+        item = self.items[int(cell.cell_data['item_id'][0])]
+        if item.scene() is not self.project.scene():
+            return
 
-    def chiptrans(self, x, y):
-        return - x + self.project.chip_width / 2, y - self.project.chip_height / 2, 0
+        self.project.scene().clearSelection()
+        item.setSelected(True)
+        self.project.ensureVisible(item)
 
     def closeEvent(self, event: QCloseEvent) -> None:
         self.plotter.close()
@@ -128,3 +102,74 @@ class CD3DViewer(QDialog):
             self.plotter.export_html(file[0])
         elif file[1] in filters[5:9]:
             self.plotter.save_graphic(file[0], title="Chip Drawer", raster=True)
+
+
+def addChip(plotter, theme, layers, chip_width, chip_height):
+    # Adds the meshes of a chip to a plotter, which does not have to be shown. Layers are (substrate, thickness,
+    # material, background material, items) from the bottom up, where every item is a list of block data. The blocks of
+    # a layer are a single mesh, with the number of the item of every cell in its item_id array. Items are numbered over
+    # all layers in the order they are given.
+    substrate_props = {k: theme.substrate3d[k] for k in theme.substrate3d.keys() if k != "thickness"}
+
+    # Materials without 3D properties are not shown
+    props = {}
+    z_cur = 0
+    first = 0
+
+    for substrate, thickness, material, background_material, items in layers:
+        for m in (material, background_material):
+            if m.name not in props:
+                props[m.name] = dict(m.get3D()) if m.get3D() else None
+
+        if substrate:
+            c = pv.Cube(center=(0, 0, z_cur + theme.substrate3d['thickness'] / 2),
+                        x_length=chip_width,
+                        y_length=chip_height,
+                        z_length=theme.substrate3d['thickness'])
+            plotter.add_mesh(c, pickable=False, **substrate_props)
+
+            z_cur += theme.substrate3d['thickness']
+
+        if props[background_material.name] is not None:
+            c = pv.Cube(center=(0, 0, z_cur + thickness / 2), x_length=chip_width, y_length=chip_height,
+                        z_length=thickness)
+            plotter.add_mesh(c, pickable=False, **props[background_material.name])
+
+        mesh = layerMesh(items, first, z_cur, thickness, chip_width, chip_height)
+        if mesh is not None and props[material.name] is not None:
+            plotter.add_mesh(mesh, **props[material.name])
+
+        first += len(items)
+        z_cur += thickness
+
+
+def layerMesh(items, first, z, thickness, chip_width, chip_height):
+    # Extrudes the outlines of all blocks over the thickness of their layer into one mesh, of which the caps are
+    # triangulated at once. The chip is centered on the origin and mirrored in x, to look at it from the same side as in
+    # the drawing.
+    points = []
+    faces = []
+    ids = []
+    offset = 0
+
+    for i, blocks in enumerate(items):
+        for data in blocks:
+            outline = chipOutline(data)
+            n = len(outline)
+            xy = np.column_stack((-outline[:, 0] + chip_width / 2, outline[:, 1] - chip_height / 2))
+            points.append(np.column_stack((np.tile(xy, (2, 1)), np.repeat((z, z + thickness), n))))
+
+            # Bottom and top cap, then a quad for every side
+            ring = np.arange(offset, offset + n)
+            sides = np.column_stack((np.full(n, 4), ring, np.roll(ring, -1), np.roll(ring, -1) + n, ring + n))
+            faces.append(np.concatenate(([n], ring[::-1], [n], ring + n, sides.ravel())))
+            ids.append(np.full(n + 2, first + i))
+
+            offset += 2 * n
+
+    if not points:
+        return None
+
+    mesh = pv.PolyData(np.concatenate(points), faces=np.concatenate(faces))
+    mesh.cell_data['item_id'] = np.concatenate(ids)
+    return mesh.triangulate()
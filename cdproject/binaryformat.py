@@ -0,0 +1,191 @@
+import gc
+import json
+import struct
+from contextlib import contextmanager
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+# Binary Chip Drawer project (.cdpb). Holds the same data as the YAML project, but stores the items of every layer per
+# type as columns: one array per item property, with all items of that type in one contiguous block. The file starts
+# with a fixed header, followed by a JSON description of the project and the columns, and then the column data itself,
+# aligned so that every column can be used straight from a memory map.
+#
+#   magic (4 bytes) | version (uint16) | reserved (uint16) | description size (uint64) | description | columns
+
+MAGIC = b'CDPB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQ')
+ALIGNMENT = 8
+
+
+def isBinaryProject(file):
+    with open(file, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save(data, file):
+    columns = []
+    offset = 0
+
+    def addColumn(array):
+        nonlocal offset
+        array = np.ascontiguousarray(array)
+        column = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        columns.append(array)
+        offset += _aligned(array.nbytes)
+        return column
+
+    description = {key: value for key, value in data.items() if key != 'layers'}
+    description['layers'] = []
+    with _collectorPaused():
+        for layer in data['layers']:
+            content = {key: value for key, value in layer['content'].items() if key != 'items'}
+            content['groups'] = _groupItems(layer['content']['items'], addColumn)
+            description['layers'].append({key: value for key, value in layer.items() if key != 'content'} |
+                                         {'content': content})
+
+    encoded = json.dumps(description).encode('utf-8')
+    encoded += b' ' * (_aligned(HEADER.size + len(encoded)) - HEADER.size - len(encoded))
+
+    with open(file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(encoded)))
+        f.write(encoded)
+        for array in columns:
+            f.write(array.tobytes())
+            f.write(b'\0' * (_aligned(array.nbytes) - array.nbytes))
+
+
+def load(file):
+    description, column = _open(file)
+
+    with _collectorPaused():
+        for layer in description['layers']:
+            content = layer['content']
+            content['items'] = _ungroupItems(content.pop('groups'), column)
+
+    return description
+
+
+def columns(file):
+    # Item columns of every layer without turning them into dictionaries, for code that works on whole arrays. Returns
+    # per layer position a list of (type, {property: array}) tuples; the arrays are read-only views on the file.
+    description, column = _open(file)
+
+    return {layer['position']: [(group['type'], {key: column(c) for key, c in group['columns'].items()})
+                                for group in layer['content']['groups']]
+            for layer in description['layers']}
+
+
+def _open(file):
+    buffer = np.memmap(file, dtype=np.uint8, mode='r')
+
+    magic, version, _, size = HEADER.unpack(buffer[:HEADER.size].tobytes())
+    if magic != MAGIC or version > VERSION:
+        raise ValueError(f"{file} is not a supported Chip Drawer binary project")
+
+    description = json.loads(buffer[HEADER.size:HEADER.size + size].tobytes().decode('utf-8'))
+    start = HEADER.size + size
+
+    def column(c):
+        dtype = np.dtype(c['dtype'])
+        offset = start + c['offset']
+        return buffer[offset:offset + int(np.prod(c['shape'])) * dtype.itemsize].view(dtype).reshape(c['shape'])
+
+    return description, column
+
+
+def _groupItems(items, addColumn):
+    # Items are grouped by type and by the properties they have, which for items from the same version of Chip Drawer
+    # is just the type
+    kinds = {}
+    for i, item in enumerate(items):
+        kinds.setdefault((item['type'], tuple(item)), []).append(i)
+
+    groups = []
+    for (t, keys), indices in kinds.items():
+        group = {'type': t, 'count': len(indices), 'order': addColumn(np.array(indices, dtype=np.uint32)),
+                 'columns': {}, 'fields': {}, 'constants': {}, 'values': {}}
+
+        selection = [items[i] for i in indices]
+        for key in keys:
+            values = list(map(itemgetter(key), selection))
+            array, fields = _columnArray(values)
+            if array is not None:
+                group['columns'][key] = addColumn(array)
+                if fields is not None:
+                    group['fields'][key] = fields
+            elif _isConstant(values):
+                group['constants'][key] = values[0]
+            else:
+                group['values'][key] = values
+
+        groups.append(group)
+
+    return groups
+
+
+def _ungroupItems(groups, column):
+    items = [None] * sum(group['count'] for group in groups)
+
+    for group in groups:
+        properties = dict(group['values'])
+        for key, c in group['columns'].items():
+            values = column(c).tolist()
+            fields = group['fields'].get(key)
+            properties[key] = [dict(zip(fields, v)) for v in values] if fields else values
+
+        constants = group['constants']
+        keys = list(properties)
+        for index, values in zip(column(group['order']).tolist(), zip(*properties.values())):
+            item = dict(constants)
+            item.update(zip(keys, values))
+            items[index] = item
+
+    return items
+
+
+def _columnArray(values):
+    # Values that can be stored as a column without losing anything: all floats, all integers, or lists or dictionaries
+    # of floats of the same size. Everything else stays in the description.
+    types = set(map(type, values))
+    if types == {float}:
+        return np.array(values, dtype=np.float64), None
+    if types == {int}:
+        try:
+            return np.array(values, dtype=np.int64), None
+        except OverflowError:
+            return None, None
+    if types == {list} and len(set(map(len, values))) == 1 and values[0] and \
+            set(map(type, chain.from_iterable(values))) == {float}:
+        return np.array(values, dtype=np.float64), None
+    if types == {dict} and len(set(map(tuple, values))) == 1 and values[0]:
+        rows = [list(v.values()) for v in values]
+        if set(map(type, chain.from_iterable(rows))) == {float}:
+            return np.array(rows, dtype=np.float64), list(values[0])
+    return None, None
+
+
+def _isConstant(values):
+    try:
+        return len(set(map(type, values))) == 1 and len(set(values)) == 1
+    except TypeError:
+        return all(v == values[0] for v in values)
+
+
+@contextmanager
+def _collectorPaused():
+    # Converting between items and columns creates many small objects, which the garbage collector would otherwise scan
+    # over and over while none of them can be garbage yet
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def _aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
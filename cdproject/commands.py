@@ -1,10 +1,23 @@
+from PyQt6.QtCore import QRectF
 from PyQt6.QtGui import QUndoCommand
 from PyQt6.QtWidgets import QGraphicsItem
 
+from buildingblocks.cells import CDCell, CDCellInstance
 from cdproject.layer import CDLayer
 
 
-class CDCommandAddLayer(QUndoCommand):
+class CDCommand(QUndoCommand):
+    # What a command changes, so that the journal can record the resulting state after it was done or undone
+    changes_layers = False
+    changes_cells = False
+
+    def changedItems(self):
+        return []
+
+
+class CDCommandAddLayer(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position, name, visible, substrate, material, background_material):
         super().__init__(f"Add layer {name}")
 
@@ -38,8 +51,10 @@ class CDCommandAddLayer(QUndoCommand):
     def undo(self) -> None:
         self.project.layer_model.beginResetModel()
 
-        self.project.scene().removeItem(self.project.chip_layers[self.position])
+        layer = self.project.chip_layers[self.position]
+        self.project.scene().removeItem(layer)
         self.project.chip_layers.pop(self.position)
+        self.project.updateSnaps(layer.blockItems())
 
         for i, layer in enumerate(self.project.chip_layers):
             layer.setZValue(-i)
@@ -48,7 +63,9 @@ class CDCommandAddLayer(QUndoCommand):
         self.project.setActiveLayer(self.position - 1)
 
 
-class CDCommandRemoveLayer(QUndoCommand):
+class CDCommandRemoveLayer(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position):
         super().__init__(f"Remove layer {project.chip_layers[position].name}")
 
@@ -64,6 +81,7 @@ class CDCommandRemoveLayer(QUndoCommand):
 
         self.project.scene().removeItem(self.project.chip_layers[self.position])
         self.project.chip_layers.pop(self.position)
+        self.project.updateSnaps(self.layer.blockItems())
 
         for i, layer in enumerate(self.project.chip_layers):
             layer.setZValue(-i)
@@ -76,6 +94,7 @@ class CDCommandRemoveLayer(QUndoCommand):
 
         self.project.chip_layers.insert(self.position, self.layer)
         self.project.scene().addItem(self.project.chip_layers[self.position])
+        self.project.updateSnaps(self.layer.blockItems())
 
         for i, layer in enumerate(self.project.chip_layers):
             layer.setZValue(-i)
@@ -84,7 +103,7 @@ class CDCommandRemoveLayer(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandChangeChipWidth(QUndoCommand):
+class CDCommandChangeChipWidth(CDCommand):
     def __init__(self, project, width):
         super().__init__("Change chip width")
 
@@ -104,7 +123,7 @@ class CDCommandChangeChipWidth(QUndoCommand):
         self.project.parent().parent().spinner_width.setValue(self.project.chip_width)
 
 
-class CDCommandChangeChipHeight(QUndoCommand):
+class CDCommandChangeChipHeight(CDCommand):
     def __init__(self, project, height):
         super().__init__("Change chip height")
 
@@ -124,7 +143,7 @@ class CDCommandChangeChipHeight(QUndoCommand):
         self.project.parent().parent().spinner_height.setValue(self.project.chip_height)
 
 
-class CDCommandChangeChipMargins(QUndoCommand):
+class CDCommandChangeChipMargins(CDCommand):
     def __init__(self, project, margin):
         super().__init__("Change chip margin")
 
@@ -144,7 +163,9 @@ class CDCommandChangeChipMargins(QUndoCommand):
         self.project.parent().parent().spinner_margins.setValue(self.project.chip_margin)
 
 
-class CDCommandLayerMaterial(QUndoCommand):
+class CDCommandLayerMaterial(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position, material):
         super().__init__(f"Change material to {material.name}")
 
@@ -167,7 +188,9 @@ class CDCommandLayerMaterial(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandLayerBackgroundMaterial(QUndoCommand):
+class CDCommandLayerBackgroundMaterial(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position, material):
         super().__init__(f"Change material to {material.name}")
 
@@ -190,7 +213,9 @@ class CDCommandLayerBackgroundMaterial(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandLayerName(QUndoCommand):
+class CDCommandLayerName(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position, name):
         super().__init__(f"Change layer name to {name}")
 
@@ -213,7 +238,9 @@ class CDCommandLayerName(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandLayerVisibility(QUndoCommand):
+class CDCommandLayerVisibility(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position, visible):
         super().__init__(f"Change layer visibility")
 
@@ -236,7 +263,9 @@ class CDCommandLayerVisibility(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandLayerSubstrate(QUndoCommand):
+class CDCommandLayerSubstrate(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position, substrate):
         super().__init__(f"Change layer substrate")
 
@@ -259,7 +288,9 @@ class CDCommandLayerSubstrate(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandLayerThickness(QUndoCommand):
+class CDCommandLayerThickness(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position, thickness):
         super().__init__(f"Change layer thickness")
 
@@ -282,7 +313,9 @@ class CDCommandLayerThickness(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandLayerUp(QUndoCommand):
+class CDCommandLayerUp(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position):
         super().__init__(f"Move layer up")
 
@@ -310,7 +343,9 @@ class CDCommandLayerUp(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandLayerDown(QUndoCommand):
+class CDCommandLayerDown(CDCommand):
+    changes_layers = True
+
     def __init__(self, project, position):
         super().__init__(f"Move layer down")
 
@@ -338,7 +373,7 @@ class CDCommandLayerDown(QUndoCommand):
         self.project.setActiveLayer(self.position)
 
 
-class CDCommandItemAdd(QUndoCommand):
+class CDCommandItemAdd(CDCommand):
     def __init__(self, project, ilayer, item):
         super().__init__(f"Add item")
 
@@ -352,14 +387,17 @@ class CDCommandItemAdd(QUndoCommand):
     def redo(self) -> None:
         self.item.setParentItem(self.project.chip_layers[self.layer])
         self.project.scene().addItem(self.item)
-        self.project.recalcSnaps()
+        self.project.updateSnaps([self.item])
 
     def undo(self) -> None:
         self.project.scene().removeItem(self.item)
-        self.project.recalcSnaps()
+        self.project.updateSnaps([self.item])
+
+    def changedItems(self):
+        return [self.item]
 
 
-class CDCommandItemsMove(QUndoCommand):
+class CDCommandItemsMove(CDCommand):
     def __init__(self, project, movelist):
         super().__init__("Move items")
 
@@ -369,15 +407,39 @@ class CDCommandItemsMove(QUndoCommand):
     def redo(self) -> None:
         for item in self.movelist:
             item[0].setPos(item[2])
-        self.project.recalcSnaps()
+        self.project.updateSnaps([item[0] for item in self.movelist])
 
     def undo(self) -> None:
         for item in self.movelist:
             item[0].setPos(item[1])
-        self.project.recalcSnaps()
+        self.project.updateSnaps([item[0] for item in self.movelist])
+
+    def changedItems(self):
+        return [item[0] for item in self.movelist]
+
 
+class CDCommandItemsFlip(CDCommand):
+    def __init__(self, project, items, horizontal):
+        super().__init__("Flip items")
 
-class CDCommandItemChangeWidth(QUndoCommand):
+        self.project = project
+        self.items = items
+        self.horizontal = horizontal
+
+    def redo(self) -> None:
+        for item in self.items:
+            item.flip(self.horizontal)
+        self.project.updateSnaps(self.items)
+
+    def undo(self) -> None:
+        # Flipping twice returns the original transformation
+        self.redo()
+
+    def changedItems(self):
+        return self.items
+
+
+class CDCommandItemChangeWidth(CDCommand):
     def __init__(self, project, items, width):
         super().__init__(f"Change item width")
 
@@ -389,16 +451,21 @@ class CDCommandItemChangeWidth(QUndoCommand):
 
     def redo(self) -> None:
         for item in self.items:
-            item.width = self.width
+            item.setParams(width=self.width)
+        self.project.updateSnaps(self.items)
 
     def undo(self) -> None:
         for i, item in enumerate(self.items):
-            item.width = self.old_widths[i]
+            item.setParams(width=self.old_widths[i])
+        self.project.updateSnaps(self.items)
 
         self.project.setItemPropsView()
 
+    def changedItems(self):
+        return self.items
 
-class CDCommandItemChangeEndWidth(QUndoCommand):
+
+class CDCommandItemChangeEndWidth(CDCommand):
     def __init__(self, project, items, width):
         super().__init__(f"Change item end width")
 
@@ -410,16 +477,21 @@ class CDCommandItemChangeEndWidth(QUndoCommand):
 
     def redo(self) -> None:
         for item in self.items:
-            item.width2 = self.endwidth
+            item.setParams(width2=self.endwidth)
+        self.project.updateSnaps(self.items)
 
     def undo(self) -> None:
         for i, item in enumerate(self.items):
-            item.width2 = self.old_endwidths[i]
+            item.setParams(width2=self.old_endwidths[i])
+        self.project.updateSnaps(self.items)
 
         self.project.setItemPropsView()
 
+    def changedItems(self):
+        return self.items
+
 
-class CDCommandItemChangeLength(QUndoCommand):
+class CDCommandItemChangeLength(CDCommand):
     def __init__(self, project, items, length):
         super().__init__(f"Change item length")
 
@@ -431,16 +503,21 @@ class CDCommandItemChangeLength(QUndoCommand):
 
     def redo(self) -> None:
         for item in self.items:
-            item.length = self.length
+            item.setParams(length=self.length)
+        self.project.updateSnaps(self.items)
 
     def undo(self) -> None:
         for i, item in enumerate(self.items):
-            item.length = self.old_lengths[i]
+            item.setParams(length=self.old_lengths[i])
+        self.project.updateSnaps(self.items)
 
         self.project.setItemPropsView()
 
+    def changedItems(self):
+        return self.items
 
-class CDCommandItemChangeRadius(QUndoCommand):
+
+class CDCommandItemChangeRadius(CDCommand):
     def __init__(self, project, items, radius):
         super().__init__(f"Change item radius")
 
@@ -452,16 +529,21 @@ class CDCommandItemChangeRadius(QUndoCommand):
 
     def redo(self) -> None:
         for item in self.items:
-            item.radius = self.radius
+            item.setParams(radius=self.radius)
+        self.project.updateSnaps(self.items)
 
     def undo(self) -> None:
         for i, item in enumerate(self.items):
-            item.radius = self.old_radii[i]
+            item.setParams(radius=self.old_radii[i])
+        self.project.updateSnaps(self.items)
 
         self.project.setItemPropsView()
 
+    def changedItems(self):
+        return self.items
+
 
-class CDCommandDeleteItems(QUndoCommand):
+class CDCommandDeleteItems(CDCommand):
     def __init__(self, project, items):
         super().__init__(f"Delete items")
 
@@ -473,11 +555,105 @@ class CDCommandDeleteItems(QUndoCommand):
         for item in self.items:
             self.project.scene().removeItem(item)
 
-        self.project.recalcSnaps()
+        self.project.updateSnaps(self.items)
 
     def undo(self) -> None:
         for i, item in enumerate(self.items):
             self.project.scene().addItem(item)
             item.setParentItem(self.parents[i])
 
-        self.project.recalcSnaps()
+        self.project.updateSnaps(self.items)
+
+    def changedItems(self):
+        return self.items
+
+
+class CDCommandCreateCell(CDCommand):
+    changes_cells = True
+
+    def __init__(self, project, name, items):
+        super().__init__(f"Create cell {name}")
+
+        self.project = project
+        self.items = items
+        self.parents = [item.parentItem() for item in self.items]
+
+        # The cell is centered on the selection, where it is placed right away. Instances in the selection are
+        # expanded, so cells never depend on other cells.
+        origin = QRectF()
+        for item in self.items:
+            origin = origin.united(item.sceneBoundingRect())
+        origin = origin.center()
+
+        # Parts are in the order of the layers, from the top down
+        parents = sorted(set(self.parents), key=project.chip_layers.index)
+        parts = {parent.name: [] for parent in parents}
+        for item, parent in zip(self.items, self.parents):
+            for data in item.flatData():
+                data['position'] = {'x': data['position']['x'] - origin.x(), 'y': data['position']['y'] - origin.y()}
+                parts[parent.name].append(data)
+        self.cell = CDCell(name, parts)
+
+        self.instances = []
+        for parent in parents:
+            instance = CDCellInstance(self.cell, parent.name)
+            instance.setFlags(instance.flags() | QGraphicsItem.GraphicsItemFlag.ItemIsSelectable |
+                              QGraphicsItem.GraphicsItemFlag.ItemIsMovable |
+                              QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges)
+            instance.setPos(origin)
+            self.instances.append((parent, instance))
+
+    def redo(self) -> None:
+        self.project.cells[self.cell.name] = self.cell
+
+        for item in self.items:
+            self.project.scene().removeItem(item)
+        for layer, instance in self.instances:
+            instance.setParentItem(layer)
+
+        self.project.updateSnaps(self.changedItems())
+
+    def undo(self) -> None:
+        for layer, instance in self.instances:
+            self.project.scene().removeItem(instance)
+        for i, item in enumerate(self.items):
+            self.project.scene().addItem(item)
+            item.setParentItem(self.parents[i])
+
+        del self.project.cells[self.cell.name]
+
+        self.project.updateSnaps(self.changedItems())
+
+    def changedItems(self):
+        return self.items + [instance for _, instance in self.instances]
+
+
+class CDCommandPlaceCell(CDCommand):
+    def __init__(self, project, cell, position, transform, layers):
+        super().__init__(f"Place cell {cell.name}")
+
+        self.project = project
+
+        # layers gives the layer of every part of the cell
+        self.instances = []
+        for part in cell.parts:
+            instance = CDCellInstance(cell, part)
+            instance.setFlags(instance.flags() | QGraphicsItem.GraphicsItemFlag.ItemIsSelectable |
+                              QGraphicsItem.GraphicsItemFlag.ItemIsMovable |
+                              QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges)
+            instance.setPos(position)
+            instance.setTransform(transform)
+            self.instances.append((layers[part], instance))
+
+    def redo(self) -> None:
+        for layer, instance in self.instances:
+            instance.setParentItem(layer)
+        self.project.updateSnaps(self.changedItems())
+
+    def undo(self) -> None:
+        for layer, instance in self.instances:
+            self.project.scene().removeItem(instance)
+        self.project.updateSnaps(self.changedItems())
+
+    def changedItems(self):
+        return [instance for _, instance in self.instances]
@@ -0,0 +1,140 @@
+import math
+import os
+import struct
+import time
+
+import numpy as np
+
+from buildingblocks import geometry
+
+# GDSII stream writer for mask fabrication. Every block becomes one BOUNDARY element, written as soon as its outline is
+# known, so a chip of any size is exported with the memory of a single block. Coordinates are stored in database units
+# of 1 nm, with the user unit set to 1 um. The y axis of the drawing points down, that of GDSII up, so the chip is
+# mirrored vertically and lies in the positive quadrant.
+
+VERSION = 600
+
+# Chip Drawer works in millimeters
+DATABASE_UNIT = 1e-9
+USER_UNIT = 1e-6
+SCALE = 1e-3 / DATABASE_UNIT
+
+# An XY record holds at most 8191 points, including the first point that closes the boundary
+MAX_POINTS = 8190
+
+HEADER = 0x0002
+BGNLIB = 0x0102
+LIBNAME = 0x0206
+UNITS = 0x0305
+ENDLIB = 0x0400
+BGNSTR = 0x0502
+STRNAME = 0x0606
+ENDSTR = 0x0700
+BOUNDARY = 0x0800
+LAYER = 0x0D02
+DATATYPE = 0x0E02
+XY = 0x1003
+ENDEL = 0x1100
+
+# Layers and datatypes are 16-bit signed numbers, and the specification only guarantees 0 to 255 for layers
+MAX_LAYER = 255
+
+
+class GDSWriter:
+    def __init__(self, file, library="CHIPDRAWER"):
+        self.file = file
+        self.library = library
+        self._stream = None
+
+    def __enter__(self):
+        self._stream = open(self.file, "wb")
+
+        stamp = self.timestamp()
+        self.record(HEADER, struct.pack('>h', VERSION))
+        self.record(BGNLIB, struct.pack('>12h', *stamp, *stamp))
+        self.record(LIBNAME, self.string(self.library))
+        self.record(UNITS, real8(DATABASE_UNIT / USER_UNIT) + real8(DATABASE_UNIT))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.record(ENDLIB)
+        finally:
+            self._stream.close()
+            # A stream without its end is of no use
+            if exc_type is not None:
+                os.remove(self.file)
+
+    @staticmethod
+    def timestamp():
+        t = time.localtime()
+        return t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec
+
+    @staticmethod
+    def string(text):
+        # Strings are padded to an even length
+        data = text.encode('ascii', 'replace')
+        return data + b'\0' * (len(data) % 2)
+
+    def record(self, kind, data=b''):
+        self._stream.write(struct.pack('>HH', len(data) + 4, kind))
+        self._stream.write(data)
+
+    def beginStructure(self, name):
+        stamp = self.timestamp()
+        self.record(BGNSTR, struct.pack('>12h', *stamp, *stamp))
+        self.record(STRNAME, self.string(name))
+
+    def endStructure(self):
+        self.record(ENDSTR)
+
+    def boundary(self, layer, points, datatype=0):
+        # Points are (N, 2) integer database units, without the closing point
+        if len(points) > MAX_POINTS:
+            raise ValueError(f"A boundary of {len(points)} points does not fit in a GDSII record")
+
+        self.record(BOUNDARY)
+        self.record(LAYER, struct.pack('>h', layer))
+        self.record(DATATYPE, struct.pack('>h', datatype))
+        self.record(XY, np.concatenate((points, points[:1])).astype('>i4').tobytes())
+        self.record(ENDEL)
+
+
+def real8(value):
+    # Eight-byte real: sign bit, excess-64 exponent of 16 in seven bits, 56-bit mantissa
+    if value == 0:
+        return b'\0' * 8
+
+    sign = 1 if value < 0 else 0
+    exponent = math.floor(math.log(abs(value), 16)) + 1
+    mantissa = round(abs(value) / 16 ** exponent * 2 ** 56)
+    # The mantissa has to be in [1/16, 1), which rounding can push just outside
+    while mantissa >= 2 ** 56:
+        mantissa //= 16
+        exponent += 1
+    while mantissa < 2 ** 52:
+        mantissa *= 16
+        exponent -= 1
+
+    return struct.pack('>Q', sign << 63 | (exponent + 64) << 56 | mantissa)
+
+
+def export(file, layers, chip_height, structure="CHIP", library="CHIPDRAWER"):
+    # Writes the blocks of every layer as boundaries. Layers are (GDSII layer number, iterable of block data) pairs,
+    # and the blocks are only read while they are written.
+    layers = list(layers)
+    for number, _ in layers:
+        if not 0 <= number <= MAX_LAYER:
+            raise ValueError(f"GDSII layer {number} is out of range, a chip can have at most {MAX_LAYER} layers")
+
+    with GDSWriter(file, library) as writer:
+        writer.beginStructure(structure)
+
+        for number, items in layers:
+            for data in items:
+                outline = geometry.chipOutline(data)
+                points = np.column_stack((outline[:, 0], chip_height - outline[:, 1]))
+                writer.boundary(number, np.rint(points * SCALE))
+
+        writer.endStructure()
@@ -0,0 +1,380 @@
+import json
+import os
+
+from PyQt6.QtWidgets import QGraphicsItem
+
+from buildingblocks import BLOCKITEMS
+from buildingblocks.cells import CDCell
+from cdproject.layer import CDLayer
+from cdproject.projectfile import readProject, writeProject
+
+VERSION = 1
+COMMIT = json.dumps({'commit': True}) + "\n"
+
+# Size in bytes of the saved part of a journal above which saving rewrites the snapshot instead
+COMPACT_SIZE = 4 * 1024 * 1024
+
+
+class CDJournal:
+    # Append-only record of the changes made to a project since its file (the snapshot) was last written completely.
+    # The journal is a JSON lines file next to the project. Its first line identifies the snapshot it belongs to; after
+    # that, every step on the undo stack appends the resulting state of the items and layers it changed. Records hold
+    # state instead of operations, so undoing and redoing are recorded the same way and replaying always ends in the
+    # same project. Saving only appends a commit marker; the snapshot is rewritten when the journal is compacted, when
+    # the saved part of the journal grows past COMPACT_SIZE and when the project is closed. Until then, a project file
+    # with a journal next to it is not complete on its own: readers that do not work on a scene should open it with
+    # readSavedProject().
+    #
+    # Layers and items are referred to by keys. Keys are given out in the order of the snapshot (layer by layer, items
+    # in order), so that they can be given out again in the same way when the snapshot is opened. Every new snapshot
+    # starts a new generation of keys, so deleted items that are still on the undo stack never share a key with a live
+    # one.
+    def __init__(self, project):
+        self.project = project
+
+        self.file = None
+        self.snapshot = None
+        self.first_record = 0
+        self.committed = 0
+        self.next_key = 0
+        self.generation = 0
+        self.buffer = None
+
+    @staticmethod
+    def journalFile(file):
+        return file + ".journal"
+
+    def isAttached(self, file):
+        return self.file is not None and self.snapshot == file
+
+    def reset(self, file):
+        # Starts a new journal for a snapshot that was just written
+        self.begin(file)
+        self.start()
+
+    def begin(self, file):
+        # Starts a new journal for a snapshot that is taken now, but written in the background. The keys have to follow
+        # the project as it is in the snapshot, while the header can only be written once the snapshot is on disk, so
+        # the changes made in the meantime are kept until then.
+        self.snapshot = file
+        self.file = self.journalFile(file)
+        self.buffer = []
+        self.assignKeys()
+
+    def start(self):
+        # Writes the journal of a snapshot that is now on disk
+        buffer, self.buffer = self.buffer, None
+
+        with open(self.file, "w") as f:
+            f.write(json.dumps({'journal': VERSION, 'snapshot': snapshotStamp(self.snapshot)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self.first_record = self.committed = f.tell()
+
+            for line in buffer:
+                f.write(line)
+                if line == COMMIT:
+                    self.committed = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+
+    def attach(self, file):
+        # Continues the journal of a snapshot that was just opened. Returns the records that were written after the last
+        # commit, which are changes that were never saved, for example because Chip Drawer crashed.
+        self.snapshot = file
+        self.file = self.journalFile(file)
+        self.assignKeys()
+
+        records = self.read()
+        if records is None:
+            self.reset(file)
+            return []
+
+        committed, pending = [], []
+        for record, end in records:
+            pending.append(record)
+            if 'commit' in record:
+                committed += pending
+                pending = []
+                self.committed = end
+
+        self.replay(committed)
+
+        return pending
+
+    def detach(self):
+        self.discardPending()
+
+        self.file = None
+        self.snapshot = None
+        self.buffer = None
+
+    def discardPending(self):
+        # Forgets changes that were journaled but never saved
+        if self.buffer is not None:
+            while self.buffer and self.buffer[-1] != COMMIT:
+                self.buffer.pop()
+        elif self.file and os.path.exists(self.file):
+            with open(self.file, "r+") as f:
+                f.truncate(self.committed)
+
+    def read(self):
+        journal = readJournal(self.snapshot)
+        if journal is None:
+            return None
+
+        self.first_record, records = journal
+        self.committed = self.first_record
+        return records
+
+    def isWriting(self):
+        return self.buffer is not None
+
+    def hasSavedChanges(self):
+        return self.file is not None and self.buffer is None and self.committed > self.first_record
+
+    def isLarge(self):
+        return self.committed - self.first_record > COMPACT_SIZE
+
+    def assignKeys(self):
+        self.generation += 1
+        self.next_key = 0
+        for layer in self.project.chip_layers:
+            self.key(layer)
+        for layer in self.project.chip_layers:
+            for item in layer.blockItems():
+                self.key(item)
+
+    def key(self, obj):
+        if obj.journal_key is None or obj.journal_key[0] != self.generation:
+            obj.journal_key = (self.generation, self.next_key)
+            self.next_key += 1
+        return obj.journal_key[1]
+
+    def setKey(self, obj, key):
+        obj.journal_key = (self.generation, key)
+        self.next_key = max(self.next_key, key + 1)
+
+    def record(self, commands):
+        if not self.file:
+            return
+
+        layers = any(command.changes_layers for command in commands)
+        cells = any(command.changes_cells for command in commands)
+        items = {item for command in commands for item in command.changedItems()}
+        if not layers and not cells and not items:
+            return
+
+        record = {}
+        if layers:
+            record['layers'] = [dict(self.layerProperties(layer), key=self.key(layer))
+                                for layer in self.project.chip_layers]
+        if cells:
+            record['cells'] = [cell.getData() for cell in self.project.cells.values()]
+        if items:
+            record['items'] = {self.key(item): None if item.scene() is None else
+                               {'layer': self.key(item.parentItem()), 'data': item.getData()}
+                               for item in items}
+
+        if self.buffer is not None:
+            self.buffer.append(json.dumps(record) + "\n")
+            return
+
+        with open(self.file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def commit(self):
+        if self.buffer is not None:
+            self.buffer.append(COMMIT)
+            return
+
+        with open(self.file, "a") as f:
+            f.write(COMMIT)
+            f.flush()
+            os.fsync(f.fileno())
+            self.committed = f.tell()
+
+    @staticmethod
+    def layerProperties(layer):
+        data = layer.getData()
+        del data['items']
+        return data
+
+    def replay(self, records):
+        project = self.project
+
+        layers = {self.key(layer): layer for layer in project.chip_layers}
+        items = {self.key(item): item for layer in project.chip_layers for item in layer.blockItems()}
+
+        for record in records:
+            if 'layers' in record:
+                self.applyLayers(record['layers'], layers)
+            if 'cells' in record:
+                self.applyCells(record['cells'])
+            if 'items' in record:
+                self.applyItems(record['items'], layers, items)
+
+        project.recalcSnaps()
+
+    def applyLayers(self, properties, layers):
+        # Layers that are no longer part of the project are kept, together with their items, in case an undo brings
+        # them back
+        project = self.project
+        project.layer_model.beginResetModel()
+
+        chip_layers = []
+        for i, p in enumerate(properties):
+            layer = layers.get(p['key'])
+            if layer is None:
+                layer = CDLayer(project, p['name'])
+                self.setKey(layer, p['key'])
+                layers[p['key']] = layer
+            if layer.scene() is None:
+                project.scene().addItem(layer)
+
+            layer.loadProperties(p)
+            layer.setZValue(-i)
+            chip_layers.append(layer)
+
+        for layer in project.chip_layers:
+            if layer not in chip_layers:
+                project.scene().removeItem(layer)
+
+        project.chip_layers = chip_layers
+        project.layer_model.endResetModel()
+
+    def applyCells(self, cells):
+        # Cells never change once they are created, so the ones that are already known are kept as they are
+        known = self.project.cells
+        self.project.cells = {cell['name']: known.get(cell['name']) or CDCell.fromData(cell) for cell in cells}
+
+    def applyItems(self, states, layers, items):
+        project = self.project
+
+        for key, state in states.items():
+            key = int(key)
+            item = items.get(key)
+
+            if state is None:
+                if item is not None and item.scene() is not None:
+                    project.scene().removeItem(item)
+                continue
+
+            data = state['data']
+            if item is None or type(item) is not BLOCKITEMS[data['type']]:
+                if item is not None and item.scene() is not None:
+                    project.scene().removeItem(item)
+                item = BLOCKITEMS[data['type']].fromData(data, project.cells)
+                item.setFlags(item.flags() | QGraphicsItem.GraphicsItemFlag.ItemIsSelectable |
+                              QGraphicsItem.GraphicsItemFlag.ItemIsMovable |
+                              QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges)
+                self.setKey(item, key)
+                items[key] = item
+            else:
+                item.loadData(data)
+
+            item.setParentItem(layers[state['layer']])
+
+
+def snapshotStamp(file):
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def readJournal(snapshot):
+    # The offset at which the records of the journal of a snapshot start, and the records with the offset at which each
+    # of them ends. None when there is no journal for the snapshot as it is on disk.
+    file = CDJournal.journalFile(snapshot)
+    if not os.path.exists(file):
+        return None
+
+    records = []
+    with open(file, "r") as f:
+        header = f.readline()
+        try:
+            header = json.loads(header)
+        except ValueError:
+            return None
+        if header.get('journal') != VERSION or header.get('snapshot') != snapshotStamp(snapshot):
+            return None
+
+        start = f.tell()
+        while line := f.readline():
+            # A record that was only partly written when Chip Drawer stopped ends the journal
+            if not line.endswith("\n"):
+                break
+            records.append((json.loads(line), f.tell()))
+
+    return start, records
+
+
+def readSavedProject(file):
+    # The data of a project as it was last saved: its snapshot with the saved records of its journal applied. Records
+    # after the last commit are changes that were never saved and are left out.
+    data = readProject(file)
+
+    journal = readJournal(file)
+    if journal is None:
+        return data
+
+    committed, pending = [], []
+    for record, _ in journal[1]:
+        pending.append(record)
+        if 'commit' in record:
+            committed += pending
+            pending = []
+
+    return applyRecords(data, committed) if committed else data
+
+
+def applyRecords(data, records):
+    # Replays records on the data of a snapshot the way CDJournal.replay() does on the scene. Keys are given out in the
+    # same order, and an item that is created, restored or moved to another layer ends up last in its layer, as it
+    # would in the scene.
+    layers = sorted(data['layers'], key=lambda x: x['position'])
+
+    properties = []
+    items = {}
+    for key, layer in enumerate(layers):
+        content = dict(layer['content'])
+        del content['items']
+        properties.append(dict(content, key=key))
+    for key, layer in enumerate(layers):
+        for item in layer['content']['items']:
+            items[len(layers) + len(items)] = (key, item)
+
+    cells = data.get('cells', [])
+    for record in records:
+        if 'layers' in record:
+            properties = record['layers']
+        if 'cells' in record:
+            cells = record['cells']
+        for key, state in record.get('items', {}).items():
+            key = int(key)
+            old = items.get(key)
+            if state is None:
+                items.pop(key, None)
+            elif old is not None and old[0] == state['layer'] and old[1]['type'] == state['data']['type']:
+                items[key] = (state['layer'], state['data'])
+            else:
+                items.pop(key, None)
+                items[key] = (state['layer'], state['data'])
+
+    return dict(data, cells=cells, layers=[
+        {
+            'position': i,
+            'content': dict({k: v for k, v in p.items() if k != 'key'},
+                            items=[item for layer_key, item in items.values() if layer_key == p['key']])
+        } for i, p in enumerate(properties)
+    ])
+
+
+def compactProject(file):
+    # Rewrites a snapshot with the saved records of its journal applied, after which the journal is no longer needed
+    writeProject(readSavedProject(file), file)
+
+    journal = CDJournal.journalFile(file)
+    if os.path.exists(journal):
+        os.remove(journal)
+
+    return file
@@ -21,6 +21,8 @@ class CDLayer(QGraphicsItem):
         self._background_material = project.theme.material(0)
         self._thickness = DEFAULT_THICKNESS
 
+        self.journal_key = None
+
     @property
     def name(self):
         return self._name
@@ -35,16 +37,15 @@ class CDLayer(QGraphicsItem):
 
     @substrate.setter
     def substrate(self, s):
-        if s:
+        if s and self._substrate is None:
             self._substrate = QGraphicsRectItem(0, 0, self._project.chip_width, self._project.chip_height, self)
             self._substrate.setBrush(QBrush(Qt.GlobalColor.blue))
             self._substrate.setPen(QPen(Qt.PenStyle.NoPen))
             self._substrate.setZValue(-20)
             self._project.scene().addItem(self._substrate)
-        else:
-            if self._substrate:
-                self._project.scene().removeItem(self._substrate)
-                self._substrate = None
+        elif not s and self._substrate:
+            self._project.scene().removeItem(self._substrate)
+            self._substrate = None
 
     @property
     def material(self):
@@ -85,12 +86,8 @@ class CDLayer(QGraphicsItem):
     def boundingRect(self) -> QRectF:
         return QRectF(0, 0, 0, 0)
 
-    def getSnaps(self, excludes=None):
-        snaps = []
-        for item in self.childItems():
-            if item != self._substrate and item not in excludes:
-                snaps += item.getSnaps()
-        return snaps
+    def blockItems(self):
+        return [item for item in self.childItems() if item != self._substrate]
 
     def itemChange(self, change: 'QGraphicsItem.GraphicsItemChange', value: typing.Any) -> typing.Any:
         if change == QGraphicsItem.GraphicsItemChange.ItemChildAddedChange:
@@ -107,10 +104,19 @@ class CDLayer(QGraphicsItem):
             'thickness': self.thickness,
             'material': self.material.name,
             'background_material': self.background_material.name,
-            'items': [item.getData() for item in self.childItems() if item != self._substrate]
+            'items': [item.getData() for item in self.blockItems()]
         }
 
+    def flatData(self):
+        # Data of all plain blocks in the layer, with the instances of cells expanded
+        for item in self.blockItems():
+            yield from item.flatData()
+
     def loadData(self, data):
+        self.loadProperties(data)
+        self.loadItems(data['items'])
+
+    def loadProperties(self, data):
         self.name = data['name']
         self.substrate = data['substrate']
         self.setVisible(data['visible'])
@@ -118,11 +124,16 @@ class CDLayer(QGraphicsItem):
         self.material = self._project.theme.material(data['material'])[1]
         self.background_material = self._project.theme.material(data['background_material'])[1]
 
-        for item in data['items']:
-            itm = BLOCKITEMS[item['type']]()
-            itm.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, True)
-            itm.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, True)
-            itm.setFlag(QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges, True)
+    def loadItems(self, items):
+        # Setting the parent also adds the item to the scene of the layer
+        flags = QGraphicsItem.GraphicsItemFlag.ItemIsSelectable | QGraphicsItem.GraphicsItemFlag.ItemIsMovable | \
+            QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges
+
+        created = []
+        for item in items:
+            itm = BLOCKITEMS[item['type']].fromData(item, self._project.cells)
+            itm.setFlags(itm.flags() | flags)
             itm.setParentItem(self)
-            itm.loadData(item)
-            self._project.scene().addItem(itm)
+            created.append(itm)
+
+        return created
@@ -0,0 +1,134 @@
+from PyQt6.QtCore import QElapsedTimer, QObject, QTimer, Qt, pyqtSignal, pyqtSlot
+from PyQt6.QtWidgets import QGraphicsView, QMessageBox, QProgressDialog
+
+from cdproject.projectfile import readProject
+from cdproject.workers import CDWorker
+
+# Time in milliseconds that the GUI thread spends creating items before it handles events again
+CHUNK_TIME = 15
+BATCH_SIZE = 64
+
+# Time in milliseconds until the view is first repainted while items are being created. Every repaint paints all items
+# created so far, so the interval doubles after each one.
+REPAINT_INTERVAL = 250
+
+
+class CDProjectLoader(QObject):
+    # Opens a project without freezing the interface. The file is parsed in a worker thread, after which the layers are
+    # created at once, so that the layer list and the chip outline can be seen right away. The items are then created
+    # on the GUI thread in time slices, with a progress dialog that allows to cancel loading.
+    finished = pyqtSignal(bool)
+
+    def __init__(self, project, file):
+        super().__init__(project)
+
+        self.project = project
+        self.file = file
+
+        self.queue = []
+        self.loaded = 0
+        self.cancelled = False
+
+        self.clock = QElapsedTimer()
+        self.repaint_clock = QElapsedTimer()
+        self.repaint_interval = REPAINT_INTERVAL
+        self.update_mode = None
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.step)
+
+        # The journal gives out its keys in the order of the file once all items are created, so the project must not
+        # be edited before then. The dialog is modal and shown right away, the view is still repainted while loading.
+        self.progress = QProgressDialog("Opening project...", "Cancel", 0, 0, project)
+        self.progress.setWindowModality(Qt.WindowModality.WindowModal)
+        self.progress.setMinimumDuration(0)
+        self.progress.canceled.connect(self.signal_cancel)
+
+        self.worker = None
+
+    def start(self):
+        self.progress.setValue(0)
+        self.progress.show()
+
+        self.worker = CDWorker(readProject, self.file)
+        self.worker.signals.finished.connect(self.parsed)
+        self.worker.signals.failed.connect(self.failed)
+        self.worker.start()
+
+    def cancel(self):
+        self.cancelled = True
+        self.stop()
+
+    def discard(self):
+        # The loader and its dialog belong to the project, which would otherwise keep them until it is closed
+        self.progress.deleteLater()
+        self.deleteLater()
+
+    def stop(self):
+        self.timer.stop()
+        self.progress.reset()
+        self.queue = []
+
+        if self.update_mode is not None:
+            self.project.setViewportUpdateMode(self.update_mode)
+            self.project.viewport().update()
+            self.update_mode = None
+
+    @pyqtSlot()
+    def signal_cancel(self):
+        if not self.cancelled:
+            self.cancel()
+            self.project.project_new()
+
+    def parsed(self, data):
+        if self.cancelled:
+            return
+
+        if not data:
+            self.failed("")
+            return
+
+        layers = self.project.loadProject(data)
+
+        self.queue = [(layer, items, 0) for layer, items in layers if items]
+        self.progress.setLabelText("Creating items...")
+        self.progress.setMaximum(max(sum(len(items) for _, items, _ in self.queue), 1))
+
+        # Every chunk would otherwise repaint all items created so far
+        self.update_mode = self.project.viewportUpdateMode()
+        self.project.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.NoViewportUpdate)
+        self.project.viewport().update()
+        self.repaint_clock.start()
+
+        self.timer.start(0)
+
+    def failed(self, error):
+        self.cancel()
+        QMessageBox.warning(self.project.parent().parent(), "Error", "Failed to open the file",
+                            QMessageBox.StandardButton.Ok)
+        self.finished.emit(False)
+
+    def step(self):
+        self.clock.start()
+
+        while self.queue and not self.clock.hasExpired(CHUNK_TIME):
+            layer, items, start = self.queue[0]
+
+            # Items are created in small batches, so the clock is not read for every single item
+            batch = items[start:start + BATCH_SIZE]
+            self.project.updateSnaps(layer.loadItems(batch))
+            self.loaded += len(batch)
+
+            if start + BATCH_SIZE < len(items):
+                self.queue[0] = (layer, items, start + BATCH_SIZE)
+            else:
+                self.queue.pop(0)
+
+        self.progress.setValue(self.loaded)
+
+        if not self.queue:
+            self.stop()
+            self.finished.emit(True)
+        elif self.repaint_clock.hasExpired(self.repaint_interval):
+            self.project.viewport().update()
+            self.repaint_clock.start()
+            self.repaint_interval *= 2
@@ -1,21 +1,37 @@
-import math
 import os
 
-import yaml
-from PyQt6.QtCore import QEvent, QModelIndex, QPointF, QRect, QRectF, QSize, Qt, pyqtSlot
+import numpy as np
+from PyQt6.QtCore import QCoreApplication, QElapsedTimer, QEvent, QLineF, QModelIndex, QPointF, QRectF, QThreadPool, \
+    QTimer, Qt, pyqtSlot
 from PyQt6.QtGui import QBrush, QEnterEvent, QIcon, QKeyEvent, QMouseEvent, QPainter, QPainterPath, QPen, QPixmap
-from PyQt6.QtSvg import QSvgGenerator
-from PyQt6.QtWidgets import QApplication, QFileDialog, QGraphicsLineItem, QGraphicsRectItem, QGraphicsScene, \
+from PyQt6.QtWidgets import QApplication, QFileDialog, QGraphicsRectItem, QGraphicsScene, \
     QGraphicsView, \
-    QInputDialog, QMessageBox
-from yaml import CLoader
+    QInputDialog, QMessageBox, QProgressDialog
 
+from buildingblocks.blockitem import DEFAULT_HANDLE_SIZE
+from buildingblocks.cells import CDCell, CDCellInstance
+from cdproject import gdsii, raster, serializers, vector
 from cdproject.commands import *
+from cdproject.journal import CDJournal, compactProject
 from cdproject.layer import CDLayer
 from cdproject.layer_model import LayerModel
+from cdproject.loader import CDProjectLoader
+from cdproject.projectfile import writeProject
+from cdproject.snapshot import CDChipSnapshot, CDLayerSnapshot
+from cdproject.snapindex import CDSnapIndex
 from cdproject.theme import CDThemeList
+from cdproject.workers import CDWorker
 from newlayerdialog import NewLayerDialog
 
+# Distance in pixels within which an item snaps to another snap point
+SNAP_DIST = 20
+
+# Size of item handles on screen, in millimeters
+HANDLE_SIZE = 2.0
+
+PROJECT_FILTERS = serializers.saveFilters()
+PROJECT_OPEN_FILTER = serializers.openFilter()
+
 
 def icon_from_color(c):
     pm = QPixmap(100, 100)
@@ -23,6 +39,26 @@ def icon_from_color(c):
     return QIcon(pm)
 
 
+class CDDragContext:
+    # Everything needed to move a selection, captured once when the drag starts. A mouse move then only translates the
+    # snap points and items by the mouse offset, instead of querying the selection and mapping every snap again.
+    def __init__(self, items, start):
+        self.items = items
+        self.exclude = set(items)
+        self.start = start
+        self.origins = [item.pos() for item in items]
+
+        snaps = [(snap.x(), snap.y()) for item in items for snap in item.getSnaps()]
+        self.snaps = np.array(snaps, dtype=np.float64).reshape(-1, 2)
+
+    def moveTo(self, offset):
+        for item, origin in zip(self.items, self.origins):
+            item.setPos(origin + offset)
+
+    def moved(self):
+        return [(item, origin, item.pos()) for item, origin in zip(self.items, self.origins) if item.pos() != origin]
+
+
 class CDProject(QGraphicsView):
     def __init__(self, parent):
         super().__init__(parent)
@@ -32,25 +68,49 @@ class CDProject(QGraphicsView):
         self.chip_height = None
         self.chip_width = None
         self.chip_layers = []
-        self.snaplist = []
-        self.snapitems = []
+        self.cells = {}
+        self.snapindex = CDSnapIndex(1.0)
+        self.snapguides = []
+        self.snapguide_pen = QPen(Qt.GlobalColor.black, 0.02, Qt.PenStyle.DotLine)
         self.floating_item = None
+        self.floating_layers = None
         self.zoom_total = None
+        self.handle_size = DEFAULT_HANDLE_SIZE
+        self._handle_key = None
+        self._screen_tracked = False
         self.chip_outline = None
         self.background = None
         self.undostack = None
 
-        self.movingselection = False
-        self.oldmovepos = None
+        self.drag = None
+
+        # Loader of the project that is being opened, if any
+        self.loader = None
+
+        self.journal = CDJournal(self)
+        self.undo_index = 0
+
+        # Projects are written in the background, one at a time, so that they reach the disk in the order of saving
+        self.save_pool = QThreadPool(self)
+        self.save_pool.setMaxThreadCount(1)
+        self.save_serial = 0
+        # Files that are rewritten from their journal after they were closed
+        self.compacting = set()
+
+        # Mouse moves that need snapping are coalesced and handled at most once per display frame
+        self.pending_move = None
+        self.move_clock = QElapsedTimer()
+        self.move_clock.start()
+        self.move_timer = QTimer(self)
+        self.move_timer.setSingleShot(True)
+        self.move_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.move_timer.timeout.connect(self.processPendingMove)
 
         self.filename = None
 
         self.layer_model = LayerModel(None, self)
         self._active_layer = -1
 
-        self.verticalScrollBar().valueChanged.connect(self.recalcSnaps)
-        self.horizontalScrollBar().valueChanged.connect(self.recalcSnaps)
-
     def initEmptyScene(self):
         # Add the first layer by default
         self.layer_model.beginResetModel()
@@ -78,6 +138,15 @@ class CDProject(QGraphicsView):
 
     def setUndoStack(self, undostack):
         self.undostack = undostack
+        self.undo_index = undostack.index()
+        self.undostack.indexChanged.connect(self.journalIndexChanged)
+
+    @pyqtSlot(int)
+    def journalIndexChanged(self, index):
+        # Commands between the old and the new index were either done or undone, both end up in the journal the same way
+        commands = [self.undostack.command(i) for i in range(min(index, self.undo_index), max(index, self.undo_index))]
+        self.journal.record([command for command in commands if command is not None])
+        self.undo_index = index
 
     def setOutlines(self):
         self.setSceneRect(-self.chip_margin,
@@ -93,10 +162,13 @@ class CDProject(QGraphicsView):
         for layer in self.chip_layers:
             layer.resize_chip()
 
+        # The chip corners are snap points as well
+        self.snapindex.set(self, [(0, 0), (self.chip_width, self.chip_height),
+                                  (0, self.chip_height), (self.chip_width, 0)])
+
     @pyqtSlot()
     def signal_toolbox_clicked(self):
         self.scene().clearSelection()
-        self.recalcSnaps()
 
         block = self.sender().block
         if block:
@@ -236,24 +308,57 @@ class CDProject(QGraphicsView):
     #                                                                         #
     ###########################################################################
 
-    def translate(self, dx: float, dy: float) -> None:
-        super().translate(dx, dy)
-        self.recalcSnaps()
-
     def recalcSnaps(self):
-        # TODO: Also collect the original scene location, because we need to do subpixel mapping
-        self.snaplist = [self.mapFromScene(0, 0), self.mapFromScene(self.chip_width, self.chip_height),
-                         self.mapFromScene(0, self.chip_height), self.mapFromScene(self.chip_width, 0)]
+        # Full rebuild of the snap index. Normal edits only update the items they touch, see updateSnaps().
+        self.snapindex.clear()
+        self.snapindex.set(self, [(0, 0), (self.chip_width, self.chip_height),
+                                  (0, self.chip_height), (self.chip_width, 0)])
 
         for layer in self.chip_layers:
-            snaps = layer.getSnaps(excludes=self.scene().selectedItems())
-            self.snaplist += [self.mapFromScene(snap) for snap in snaps]
+            for item in layer.blockItems():
+                self.snapindex.set(item, [(snap.x(), snap.y()) for snap in item.getSnaps()])
+
+        self.updateScaling()
+
+    def updateSnaps(self, items):
+        # Items that are (still) part of a layer in the scene keep their snap points, all others lose them
+        for item in items:
+            layer = item.parentItem()
+            if item.scene() is self.scene() and layer in self.chip_layers:
+                self.snapindex.set(item, [(snap.x(), snap.y()) for snap in item.getSnaps()])
+            else:
+                self.snapindex.remove(item)
+
+    def snapDistance(self):
+        # The snap distance is defined in pixels, the snap index works in scene coordinates
+        return SNAP_DIST / self.transform().m11()
+
+    def updateScaling(self):
+        # Everything that depends on the zoom level. The handle size is only recalculated when the zoom or the screen
+        # resolution actually changed.
+        self.snapindex.setCellSize(self.snapDistance())
+
+        dpi = self.screen().physicalDotsPerInch() if self.screen() else 96
+        key = (self.transform().m11(), dpi)
+        if key != self._handle_key:
+            self._handle_key = key
+            self.handle_size = dpi * HANDLE_SIZE / 25.4 / self.transform().m11()  # 25.4 mm/inch
+
+    def showEvent(self, event) -> None:
+        super().showEvent(event)
+
+        # Moving the window to another screen can change the resolution
+        window = self.window().windowHandle()
+        if window and not self._screen_tracked:
+            self._screen_tracked = True
+            window.screenChanged.connect(lambda screen: self.updateScaling())
+            self.updateScaling()
 
     def resizeEvent(self, event) -> None:
         self.fitInView(self.sceneRect(), Qt.AspectRatioMode.KeepAspectRatio)
         self.scale(self.zoom_total, self.zoom_total)
 
-        self.recalcSnaps()
+        self.updateScaling()
 
     def wheelEvent(self, event):
         modifiers = QApplication.keyboardModifiers()
@@ -280,6 +385,7 @@ class CDProject(QGraphicsView):
             new_pos = self.mapToScene(event.position().toPoint())
 
             self.zoom_total *= zoom_factor
+            self.updateScaling()
 
             # Move scene to old position
             delta = new_pos - old_pos
@@ -315,54 +421,90 @@ class CDProject(QGraphicsView):
         if self.floating_item:
             self.floating_item.setVisible(False)
 
+    def frameInterval(self):
+        rate = self.screen().refreshRate() if self.screen() else 0
+        return int(1000 / rate) if rate > 0 else 16
+
     def mouseMoveEvent(self, event: QMouseEvent) -> None:
-        super().mouseMoveEvent(event)
+        if not self.floating_item and not self.drag:
+            super().mouseMoveEvent(event)
+            return
+
+        # Only the latest position matters. The first move after a pause is handled right away (the timer fires on the
+        # next pass of the event loop), after that at most once per frame.
+        self.pending_move = QMouseEvent(event.type(), event.position(), event.globalPosition(), event.button(),
+                                        event.buttons(), event.modifiers())
+        if not self.move_timer.isActive():
+            self.move_timer.start(max(0, self.frameInterval() - self.move_clock.elapsed()))
+
+    @pyqtSlot()
+    def processPendingMove(self):
+        self.move_timer.stop()
+
+        event = self.pending_move
+        if not event:
+            return
+
+        self.pending_move = None
+        self.move_clock.restart()
+
+        # The selection is moved by the drag context, not by the scene
+        if not self.drag:
+            super().mouseMoveEvent(event)
 
         if self.floating_item:
             # TODO: Implement that the item cannot leave the drawing area
             self.floating_item.setPos(self.mapToScene(event.position().toPoint()))
 
-            flsnaps = self.floating_item.getSnaps()
+            flsnaps = [(snap.x(), snap.y()) for snap in self.floating_item.getSnaps()]
 
             coords = self.getSnapCoordinates(flsnaps)
             if coords:
                 self.floating_item.snapTo(*coords[:3])
 
-        elif self.scene().selectedItems() and self.movingselection:
-            # Make list of snap points
-            snaps = []
-            snapmap = []
-            for item in self.scene().selectedItems():
-                for i, isn in enumerate(item.getSnaps()):
-                    snaps.append(isn)
-                    snapmap.append((item, i))
-
-            coords = self.getSnapCoordinates(snaps)
+        elif self.drag:
+            offset = self.mapToScene(event.position().toPoint()) - self.drag.start
+            snaps = self.drag.snaps + (offset.x(), offset.y())
 
+            coords = self.getSnapCoordinates(snaps, exclude=self.drag.exclude)
             if coords:
-                relative = [item.pos() - snapmap[coords[0]][0].pos() for item in self.scene().selectedItems()]
-
-                snapmap[coords[0]][0].snapTo(snapmap[coords[0]][1], *coords[1:3])
+                # Shift the whole selection so that the snapping point lands on its target
+                x, y = snaps[coords[0]]
+                offset += coords[2] - QPointF(x, y)
 
-                for i, item in enumerate(self.scene().selectedItems()):
-                    item.setPos(snapmap[coords[0]][0].pos() + relative[i])
+            self.drag.moveTo(offset)
 
     def mousePressEvent(self, event: QMouseEvent) -> None:
+        self.processPendingMove()
         super().mousePressEvent(event)
 
         if self.floating_item:
             return
-        elif self.scene().selectedItems():
-            self.movingselection = True
-            self.oldmovepos = [item.pos() for item in self.scene().selectedItems()]
-            self.recalcSnaps()
+
+        # Only start moving when the press landed on (and therefore selected) an item, not for rubber band selections
+        grabber = self.scene().mouseGrabberItem()
+        if grabber and grabber.isSelected():
+            self.drag = CDDragContext(self.scene().selectedItems(), self.mapToScene(event.position().toPoint()))
 
     def mouseReleaseEvent(self, event: QMouseEvent) -> None:
         # TODO: Add ability to rotate a selection with right mouse key
+        self.processPendingMove()
         super().mouseReleaseEvent(event)
 
         if self.floating_item:
-            if event.button() == Qt.MouseButton.LeftButton:
+            if event.button() == Qt.MouseButton.LeftButton and isinstance(self.floating_item, CDCellInstance):
+                # Layers may have been removed since the cell was picked
+                if not all(layer in self.chip_layers for layer in self.floating_layers.values()):
+                    self.floating_layers = self.cellLayers(self.floating_item.cell)
+                if self.floating_layers is not None:
+                    self.undostack.push(CDCommandPlaceCell(
+                        self, self.floating_item.cell, self.floating_item.pos(), self.floating_item.transform(),
+                        self.floating_layers
+                    ))
+                else:
+                    self.scene().removeItem(self.floating_item)
+                    self.floating_item = None
+            elif event.button() == Qt.MouseButton.LeftButton:
                 self.undostack.push(CDCommandItemAdd(
                     self, self._active_layer, self.floating_item.copy()
                 ))
@@ -370,103 +512,65 @@ class CDProject(QGraphicsView):
                 self.floating_item.setRotation((self.floating_item.rotation() + 90) % 360)
 
             self.setItemPropsView()
-        elif self.scene().selectedItems() and self.movingselection:
-            self.movingselection = False
-
-            moved = False
-            for i, item in enumerate(self.scene().selectedItems()):
-                if item.pos() != self.oldmovepos[i]:
-                    moved = True
-
-            if moved:
-                movelist = []
-                for i, item in enumerate(self.scene().selectedItems()):
-                    movelist.append((item, self.oldmovepos[i], item.pos()))
+        elif self.drag:
+            movelist = self.drag.moved()
+            self.drag = None
 
+            if movelist:
                 self.undostack.push(CDCommandItemsMove(self, movelist))
 
             self.setItemPropsView()
         elif self.scene().selectedItems():
             self.setItemPropsView()
-        else:
-            self.recalcSnaps()
 
-        for item in self.snapitems:
-            self.scene().removeItem(item)
+        self.setSnapGuides([])
 
-        self.snapitems.clear()
+    def setSnapGuides(self, guides):
+        if guides == self.snapguides:
+            return
 
-    def sort_snaps(self, e):
-        return e[3]
+        # The guides are drawn on top of the scene by drawForeground, so only the areas covered by the old and the new
+        # guides need to be repainted
+        w = self.snapguide_pen.widthF()
+        for line in self.snapguides + guides:
+            r = QRectF(line.p1(), line.p2()).normalized().adjusted(-w, -w, w, w)
+            self.viewport().update(self.mapFromScene(r).boundingRect().adjusted(-1, -1, 1, 1))
 
-    def getSnapCoordinates(self, points):
-        # TODO: Became rather large. Can we improve?
-        # TODO: Snapping line end-points are given by the mouse position, not by the final snapping position. Fix that.
-        DIST = 20
-        snaps = []
-
-        for item in self.snapitems:
-            self.scene().removeItem(item)
-
-        self.snapitems.clear()
-
-        for i, point in enumerate(points):
-            px = self.mapFromScene(point)
-
-            for snap in self.snaplist:
-                if abs(px.x() - snap.x()) < DIST and abs(px.y() - snap.y()) < DIST:
-                    snaps += [(i,
-                               'xy',
-                               self.mapToScene(snap),
-                               math.sqrt((snap.x() - px.x()) ** 2 + (snap.y() - px.y()) ** 2),
-                               self.mapToScene(snap))]
-                if abs(px.x() - snap.x()) < DIST:
-                    snaps += [(i,
-                               'x',
-                               self.mapToScene(snap.x(), px.y()),
-                               math.sqrt((snap.x() - px.x()) ** 2 + (snap.y() - px.y()) ** 2),
-                               self.mapToScene(snap))]
-                if abs(px.y() - snap.y()) < DIST:
-                    snaps += [(i,
-                               'y',
-                               self.mapToScene(px.x(), snap.y()),
-                               math.sqrt((snap.x() - px.x()) ** 2 + (snap.y() - px.y()) ** 2),
-                               self.mapToScene(snap))]
+        self.snapguides = guides
 
-        if snaps:
-            snaps.sort(key=self.sort_snaps)
+    def drawForeground(self, painter: QPainter, rect: QRectF) -> None:
+        super().drawForeground(painter, rect)
 
-            has_x = False
-            has_y = False
-            has_xy = False
+        if self.snapguides:
+            painter.setPen(self.snapguide_pen)
+            painter.drawLines(self.snapguides)
 
-            pen = QPen(Qt.GlobalColor.black, 0.02, Qt.PenStyle.DotLine)
-            for snap in snaps:
-                if snap[1] == 'x' and not has_x:
-                    has_x = True
-                    item = QGraphicsLineItem(snap[2].x(), snap[2].y(), snap[2].x(),
-                                             snap[4].y())
-                    item.setPen(pen)
-                    self.snapitems.append(item)
-                    self.scene().addItem(item)
-                elif snap[1] == 'y' and not has_y:
-                    has_y = True
-                    item = QGraphicsLineItem(snap[2].x(), snap[2].y(), snap[4].x(),
-                                             snap[2].y())
-                    item.setPen(pen)
-                    self.snapitems.append(item)
-                    self.scene().addItem(item)
-                elif snap[1] == 'xy' and not has_xy:
-                    has_xy = True
-                    item = QGraphicsLineItem(snap[2].x() - 0.2, snap[2].y(), snap[2].x() + 0.2, snap[2].y())
-                    item.setPen(pen)
-                    self.snapitems.append(item)
-                    self.scene().addItem(item)
-                    item2 = QGraphicsLineItem(snap[2].x(), snap[2].y() - 0.2, snap[2].x(), snap[2].y() + 0.2)
-                    item2.setPen(pen)
-                    self.snapitems.append(item2)
-                    self.scene().addItem(item2)
+    def getSnapCoordinates(self, points, exclude=()):
+        # TODO: Became rather large. Can we improve?
+        # TODO: Snapping line end-points are given by the mouse position, not by the final snapping position. Fix that.
+        snaps = [(i, t, QPointF(*pos), d, QPointF(*snap)) for i, t, pos, d, snap in
+                 self.snapindex.candidatesVectorized(points, self.snapDistance(), exclude)]
+
+        guides = []
+        has_x = False
+        has_y = False
+        has_xy = False
+
+        for snap in snaps:
+            if snap[1] == 'x' and not has_x:
+                has_x = True
+                guides.append(QLineF(snap[2].x(), snap[2].y(), snap[2].x(), snap[4].y()))
+            elif snap[1] == 'y' and not has_y:
+                has_y = True
+                guides.append(QLineF(snap[2].x(), snap[2].y(), snap[4].x(), snap[2].y()))
+            elif snap[1] == 'xy' and not has_xy:
+                has_xy = True
+                guides.append(QLineF(snap[2].x() - 0.2, snap[2].y(), snap[2].x() + 0.2, snap[2].y()))
+                guides.append(QLineF(snap[2].x(), snap[2].y() - 0.2, snap[2].x(), snap[2].y() + 0.2))
+
+        self.setSnapGuides(guides)
 
+        if snaps:
             # If there is an xy snap point, return it
             for snap in snaps:
                 if snap[1] == 'xy':
@@ -510,18 +614,19 @@ class CDProject(QGraphicsView):
             case Qt.Key.Key_Down:
                 print("Down key pressed")
             case Qt.Key.Key_W:
-                if not self.scene().selectedItems():
+                items = [item for item in self.scene().selectedItems() if hasattr(item, 'width')]
+                if not items:
                     return
 
                 w, ok = QInputDialog.getDouble(self.parent().parent(),
                                                "Set item(s) width",
                                                "Width (mm)",
-                                               value=self.scene().selectedItems()[0].width,
+                                               value=items[0].width,
                                                min=0.0,
                                                decimals=2,
                                                step=0.01)
                 if ok:
-                    self.undostack.push(CDCommandItemChangeWidth(self, self.scene().selectedItems(), w))
+                    self.undostack.push(CDCommandItemChangeWidth(self, items, w))
                     self.setItemPropsView()
             case Qt.Key.Key_L:
                 if not self.scene().selectedItems():
@@ -570,25 +675,17 @@ class CDProject(QGraphicsView):
                                                                    hasattr(item, 'radius')], r))
                     self.setItemPropsView()
             case Qt.Key.Key_V:
-                # TODO: Make flipping an undostack command.
                 # TODO: Implement flipping of a complete selection
                 if self.floating_item:
                     self.floating_item.flip(False)
-                else:
-                    for item in self.scene().selectedItems():
-                        item.flip(False)
-
-                self.recalcSnaps()
+                elif self.scene().selectedItems():
+                    self.undostack.push(CDCommandItemsFlip(self, self.scene().selectedItems(), False))
             case Qt.Key.Key_H:
-                # TODO: Make flipping an undostack command.
                 # TODO: Implement flipping of a complete selection
                 if self.floating_item:
                     self.floating_item.flip(True)
-                else:
-                    for item in self.scene().selectedItems():
-                        item.flip(True)
-
-                self.recalcSnaps()
+                elif self.scene().selectedItems():
+                    self.undostack.push(CDCommandItemsFlip(self, self.scene().selectedItems(), True))
 
     ###########################################################################
     #                                                                         #
@@ -619,6 +716,88 @@ class CDProject(QGraphicsView):
         p.addRect(self.background.rect())
         self.scene().setSelectionArea(p)
 
+    ###########################################################################
+    #                                                                         #
+    #  Cells                                                                  #
+    #                                                                         #
+    ###########################################################################
+
+    @pyqtSlot()
+    def signal_create_cell(self):
+        items = self.scene().selectedItems()
+        if not items:
+            return
+
+        i = len(self.cells) + 1
+        while f"Cell {i}" in self.cells:
+            i += 1
+
+        # Parts of cells are kept per layer name, so blocks of layers that share a name can not be told apart
+        names = [layer.name for layer in {item.parentItem() for item in items}]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            QMessageBox.warning(self.parent().parent(), "Error",
+                                f"The selection is on several layers named {', '.join(duplicates)}. Give these layers "
+                                f"different names before creating a cell.", QMessageBox.StandardButton.Ok)
+            return
+
+        name, ok = QInputDialog.getText(self.parent().parent(), "Create cell", "Name of the cell", text=f"Cell {i}")
+        if not ok or not name:
+            return
+        if name in self.cells:
+            QMessageBox.warning(self.parent().parent(), "Error", f"There already is a cell named {name}",
+                                QMessageBox.StandardButton.Ok)
+            return
+
+        self.undostack.push(CDCommandCreateCell(self, name, items))
+        self.setItemPropsView()
+
+    @pyqtSlot()
+    def signal_place_cell(self):
+        if not self.cells:
+            return
+
+        name, ok = QInputDialog.getItem(self.parent().parent(), "Place cell", "Cell", list(self.cells), editable=False)
+        if not ok:
+            return
+
+        layers = self.cellLayers(self.cells[name])
+        if layers is None:
+            return
+
+        # The cell follows the mouse like a block from the toolbox, until it is placed
+        self.scene().clearSelection()
+        if self.floating_item:
+            self.scene().removeItem(self.floating_item)
+
+        self.floating_item = CDCellInstance(self.cells[name])
+        self.floating_item.setZValue(1000)
+        self.floating_item.setVisible(False)
+        self.scene().addItem(self.floating_item)
+        self.floating_layers = layers
+        self.setItemPropsView()
+
+    def cellLayers(self, cell):
+        # The layer of every part of a cell, by name. For parts whose layer no longer exists the user picks another
+        # layer. Returns None when the user cancels.
+        names = {}
+        for layer in self.chip_layers:
+            names.setdefault(layer.name, layer)
+
+        layers = {}
+        for part in cell.parts:
+            if part not in names:
+                name, ok = QInputDialog.getItem(self.parent().parent(), "Place cell",
+                                                f"There is no layer named {part} anymore. Layer for the blocks of "
+                                                f"{cell.name} that were on {part}:", list(names), editable=False)
+                if not ok:
+                    return None
+                layers[part] = names[name]
+            else:
+                layers[part] = names[part]
+
+        return layers
+
     ###########################################################################
     #                                                                         #
     #  Loading and saving                                                     #
@@ -626,11 +805,27 @@ class CDProject(QGraphicsView):
     ###########################################################################
 
     def project_new(self, initempty=True):
+        # A project that is still being loaded would otherwise keep adding items to the new one
+        if self.loader:
+            self.loader.cancel()
+            self.loader.discard()
+            self.loader = None
+
+        self.project_close()
+        # Saves of the old project that are still being written no longer concern the new one
+        self.save_serial += 1
+
+        # The old scene is replaced below, so there is no point in keeping its index up to date while emptying it
+        if self.scene() and self.chip_layers:
+            self.scene().setItemIndexMethod(QGraphicsScene.ItemIndexMethod.NoIndex)
+
         self.layer_model.beginResetModel()
         for layer in self.chip_layers:
             self.scene().removeItem(layer)
         self.chip_layers = []
         self.layer_model.endResetModel()
+        self.snapindex.clear()
+        self.cells = {}
 
         # TODO: Change this to adhere to the defaults in the settings file
         self.chip_width = self.parent().parent().spinner_width.value()
@@ -683,7 +878,6 @@ class CDProject(QGraphicsView):
 
         # Mouse stuff
         self.floating_item = None
-        self.snaplist = []
 
         # self.selected_items = []
         # self.selection_moved = False
@@ -695,22 +889,22 @@ class CDProject(QGraphicsView):
 
         self.undostack.clear()
 
-    def project_save(self, export=False, saveas=False):
+    def project_save(self, export=False, saveas=False, compact=False, wait=False):
         file = None
         if export:
             file = QFileDialog.getSaveFileName(parent=self.parent().parent(),
                                                caption="Export Chip Drawer project",
                                                directory=self.parent().parent().settings.value("default_directory"),
-                                               filter="Chip Drawer Project (*.cdp)")[0]
+                                               filter=PROJECT_FILTERS)[0]
             if not file:
-                return
+                return False
         elif saveas:
             file = QFileDialog.getSaveFileName(parent=self.parent().parent(),
                                                caption="Save Chip Drawer project as...",
                                                directory=self.parent().parent().settings.value("default_directory"),
-                                               filter="Chip Drawer Project (*.cdp)")[0]
+                                               filter=PROJECT_FILTERS)[0]
             if not file:
-                return
+                return False
 
             self.filename = file
         elif self.filename:
@@ -720,16 +914,107 @@ class CDProject(QGraphicsView):
             file = QFileDialog.getSaveFileName(parent=self.parent().parent(),
                                                caption="Save Chip Drawer project...",
                                                directory=self.parent().parent().settings.value("default_directory"),
-                                               filter="Chip Drawer Project (*.cdp)")[0]
+                                               filter=PROJECT_FILTERS)[0]
             if not file:
-                return
+                return False
 
             self.filename = file
 
-        successful = False
+        # While the file is the snapshot of the journal, saving only has to mark the journaled changes as saved
+        if not export and not compact and self.journal.isAttached(file):
+            self.journal.commit()
+            self.undostack.setClean()
+            self.undostack.cleanChanged.emit(True)
+            # Readers that do not know about the journal only see the snapshot, so once the journal has grown large the
+            # snapshot is rewritten below. The project is now exactly as it was saved, so it can be taken as it is.
+            if not self.journal.isLarge():
+                return True
+
+        # The data is taken from the project now, and written in the background while editing continues
+        data = self.getData()
+        serial = None
+        if not export:
+            self.save_serial += 1
+            serial = self.save_serial
+            self.journal.detach()
+            self.journal.begin(file)
+
+        index = self.undostack.index()
+
+        worker = CDWorker(writeProject, data, file)
+        worker.signals.finished.connect(lambda _: self.project_saved(serial, index))
+        worker.signals.failed.connect(lambda error: self.project_save_failed(serial))
+
+        if wait:
+            # Saving before the project is closed, so the file has to be complete before continuing
+            failed = []
+            worker.signals.failed.connect(failed.append)
+            self.finishSaving()
+            worker.run()
+            return not failed
+
+        worker.start(self.save_pool)
+        return True
+
+    def project_saved(self, serial, index):
+        # Only the latest save of the current project decides about the journal and the clean state
+        if serial is None or serial != self.save_serial:
+            return
+
+        self.journal.start()
+
+        # Changes made while the file was written are not in it
+        if self.undostack.index() != index:
+            return
+
+        if self.undostack.isClean():
+            self.undostack.cleanChanged.emit(True)
+        else:
+            self.undostack.setClean()
+
+    def project_save_failed(self, serial):
+        if serial is not None and serial == self.save_serial:
+            self.journal.detach()
+            # Changes that were marked as saved since may not be in any file
+            self.undostack.resetClean()
+
+        QMessageBox.warning(self.parent().parent(), "Error", "Failed to save the file",
+                            QMessageBox.StandardButton.Ok)
+
+    def project_close(self):
+        # Changes that were not saved should not be offered for recovery the next time the project is opened. The saved
+        # ones are folded into the file in the background, so that the file is complete on its own again.
+        if self.journal.isWriting():
+            # The journal of a snapshot that is still being written only exists once the snapshot is on disk
+            self.finishSaving()
+
+        file = self.journal.snapshot if self.journal.hasSavedChanges() else None
+        self.journal.detach()
+        if not file:
+            return
 
-        data = {
+        self.compacting.add(os.path.abspath(file))
+        worker = CDWorker(compactProject, file)
+        worker.signals.finished.connect(lambda _: self.compacting.discard(os.path.abspath(file)))
+        worker.signals.failed.connect(lambda error: self.project_compact_failed(file))
+        worker.start(self.save_pool)
+
+    def project_compact_failed(self, file):
+        self.compacting.discard(os.path.abspath(file))
+        QMessageBox.warning(self.parent().parent(), "Error",
+                            f"Failed to update {file} with the changes saved in {CDJournal.journalFile(file)}. The "
+                            f"changes are kept there, and are applied when the project is opened again.",
+                            QMessageBox.StandardButton.Ok)
+
+    def finishSaving(self):
+        # Waits for the files that are still being written, and handles their completion right away
+        self.save_pool.waitForDone()
+        QCoreApplication.sendPostedEvents()
+
+    def getData(self):
+        return {
             'theme': self.theme.name,
+            'cells': [cell.getData() for cell in self.cells.values()],
             'layers': [
                 {
                     'position': i,
@@ -738,61 +1023,86 @@ class CDProject(QGraphicsView):
             ]
         }
 
-        with open(file, "w") as f:
-            f.write(yaml.dump(data))
-
-        successful = True
-
-        if not export and successful:
-            if self.undostack.isClean():
-                self.undostack.cleanChanged.emit(True)
-            else:
-                self.undostack.setClean()
-
     def project_open(self):
         file = QFileDialog.getOpenFileName(parent=self.parent().parent(),
                                            caption="Open Chip Drawer project...",
                                            directory=self.parent().parent().settings.value("default_directory"),
-                                           filter="Chip Drawer Project (*.cdp)")[0]
+                                           filter=PROJECT_OPEN_FILTER)[0]
 
         if file:
-            with open(file, "r") as f:
-                data = yaml.load(f.read(), Loader=CLoader)
+            # A project that was just closed may still be rewritten from its journal, which has to finish before the
+            # file is read again
+            self.project_close()
+            if os.path.abspath(file) in self.compacting:
+                self.finishSaving()
+            self.loader = CDProjectLoader(self, file)
+            self.loader.finished.connect(self.project_loaded)
+            self.loader.start()
+
+    def loadProject(self, data):
+        # Starts a new project from the data of a file, with all of its layers but without any items yet. Returns the
+        # layers together with the data of the items that still need to be created in them.
+        loader, self.loader = self.loader, None
+        self.project_new(False)
+        self.loader = loader
+
+        self.theme = self.themelist.getTheme(data['theme'])
 
-            if not data:
-                QMessageBox.warning(self.parent().parent(), "Error", "Failed to open the file",
-                                    QMessageBox.StandardButton.Ok)
-                return
+        # Load materials into the material properties list
+        self.parent().parent().layer_prop_material.clear()
+        for i, material in enumerate(self.theme.materials()):
+            self.parent().parent().layer_prop_material.addItem(icon_from_color(material.displayColor),
+                                                               material.name)
+        self.parent().parent().layer_prop_background_material.clear()
+        for i, material in enumerate(self.theme.materials()):
+            self.parent().parent().layer_prop_background_material.addItem(icon_from_color(material.displayColor),
+                                                                          material.name)
 
-            self.project_new(False)
+        # Cells have to be known before the items that place them are created
+        self.cells = {cell['name']: CDCell.fromData(cell) for cell in data.get('cells', [])}
 
-            self.theme = self.themelist.getTheme(data['theme'])
+        data['layers'].sort(key=lambda x: x['position'])
 
-            # Load materials into the material properties list
-            self.parent().parent().layer_prop_material.clear()
-            for i, material in enumerate(self.theme.materials()):
-                self.parent().parent().layer_prop_material.addItem(icon_from_color(material.displayColor),
-                                                                   material.name)
-            self.parent().parent().layer_prop_background_material.clear()
-            for i, material in enumerate(self.theme.materials()):
-                self.parent().parent().layer_prop_background_material.addItem(icon_from_color(material.displayColor),
-                                                                              material.name)
+        layers = []
+        self.layer_model.beginResetModel()
+        for i, layer in enumerate(data['layers']):
+            newlayer = CDLayer(self, layer['content']['name'])
+            self.chip_layers.append(newlayer)
+            self.scene().addItem(newlayer)
+            newlayer.loadProperties(layer['content'])
+            newlayer.setZValue(-i)
+            layers.append((newlayer, layer['content']['items']))
 
-            data['layers'].sort(key=lambda x: x['position'])
+        self.layer_model.endResetModel()
 
-            self.layer_model.beginResetModel()
-            for i, layer in enumerate(data['layers']):
-                newlayer = CDLayer(self, layer['content']['name'])
-                self.chip_layers.append(newlayer)
-                self.scene().addItem(newlayer)
-                newlayer.loadData(layer['content'])
-                newlayer.setZValue(-i)
+        self.setActiveLayer(0)
 
-            self.layer_model.endResetModel()
+        return layers
 
-            self.setActiveLayer(0)
+    @pyqtSlot(bool)
+    def project_loaded(self, successful):
+        file = self.loader.file
+        self.loader.discard()
+        self.loader = None
+
+        if not successful:
+            return
+
+        self.filename = file
+
+        # Changes that were journaled but never saved are only restored when asked for
+        pending = self.journal.attach(file)
+        if pending:
+            d = QMessageBox.question(self.parent().parent(), "Chip Drawer",
+                                     "This project has changes that were not saved. Do you want to recover them?",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            if d == QMessageBox.StandardButton.Yes:
+                self.journal.replay(pending)
+                self.undostack.cleanChanged.emit(False)
+                return
+            self.journal.discardPending()
 
-            self.recalcSnaps()
+        self.undostack.cleanChanged.emit(True)
 
     def setItemPropsView(self):
         v = None
@@ -811,6 +1121,10 @@ class CDProject(QGraphicsView):
         else:
             return
 
+        # Instances of cells have no parameters of their own
+        if not hasattr(v, 'width'):
+            return
+
         self.parent().parent().item_props.setEnabled(True)
         self.parent().parent().item_prop_width.setValue(v.width)
 
@@ -834,7 +1148,8 @@ class CDProject(QGraphicsView):
         if self.floating_item:
             self.floating_item.width = v
         elif self.scene().selectedItems():
-            self.undostack.push(CDCommandItemChangeWidth(self, self.scene().selectedItems(), v))
+            self.undostack.push(
+                CDCommandItemChangeWidth(self, [i for i in self.scene().selectedItems() if hasattr(i, 'width')], v))
 
     @pyqtSlot()
     def signal_item_changed_radius(self):
@@ -872,62 +1187,106 @@ class CDProject(QGraphicsView):
             "Portable Network Graphics (*.png)",
             "Joint Photographics Experts Group (*.jpg)",
             "Windows Bitmap (*.bmp)",
-            "Scalable Vector Graphics (*.svg)"
+            "Scalable Vector Graphics (*.svg)",
+            "Portable Document Format (*.pdf)",
+            "GDSII Stream (*.gds)"
         ]
         file = QFileDialog.getSaveFileName(parent=self.parent().parent(),
                                            caption="Export 2D Bitmap or Vector",
                                            directory=self.parent().parent().settings.value("default_directory"),
                                            filter=";;".join(filters))
-        if not file:
+        if not file[0]:
             return
 
-        # Hide the floating item
-        if self.floating_item:
-            wasvisible = self.floating_item.isVisible()
-            self.floating_item.setVisible(False)
-
-        # Clear the snap lines
-        for item in self.snapitems:
-            item.setVisible(False)
-
-        # Clear the selection
-        wasselected = self.scene().selectedItems()
-        for item in wasselected:
-            item.setSelected(False)
-
-        if file[1] in filters[0:3]:
-            print("Bitmap!")
-            r = QRectF(0, 0, 2000, 2000 * (self.scene().sceneRect().height() / self.scene().sceneRect().width()))
-            pm = QPixmap(r.size().toSize())
-            painter = QPainter(pm)
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-            self.scene().render(painter, r, self.scene().sceneRect(), Qt.AspectRatioMode.KeepAspectRatio)
-            painter.end()
-
-            pm.save(file[0])
+        # GDSII is written from the block data, not rendered from the scene
+        if file[1] == filters[5] or file[0].lower().endswith(".gds"):
+            self.exportGDS(file[0])
+        elif file[1] in filters[0:3]:
+            self.exportRaster(file[0])
         else:
-            svggen = QSvgGenerator()
-            svggen.setFileName(file[0])
-            svggen.setResolution(1)
-            svggen.setSize(QSize(self.chip_width + 2 * self.chip_margin, self.chip_height + 2 * self.chip_margin))
-            svggen.setViewBox(
-                QRect(0, 0, self.chip_width + 2 * self.chip_margin, self.chip_height + 2 * self.chip_margin))
-            painter = QPainter()
-            painter.begin(svggen)
-            self.scene().render(painter)
-            painter.end()
-
-        # Show the floating item again
-        if self.floating_item:
-            self.floating_item.setVisible(wasvisible)
-
-        # Return the snap items
-        for item in self.snapitems:
-            item.setVisible(True)
+            self.exportVector(file[0])
+
+    def chipSnapshot(self):
+        # The visible layers from the bottom up, as plain data that exporters can use in other threads
+        chip = CDChipSnapshot(self.scene().sceneRect(), self.chip_width, self.chip_height)
+        for layer in reversed(self.chip_layers):
+            if not layer.isVisible():
+                continue
+            snapshot = CDLayerSnapshot(layer.material.displayColor, Qt.GlobalColor.blue if layer.substrate else None,
+                                       layer.name, layer.material.name)
+            for item in layer.blockItems():
+                snapshot.addItem(item.sceneBoundingRect(), list(item.flatData()))
+            chip.addLayer(snapshot)
+
+        return chip
+
+    def exportRaster(self, file):
+        settings = self.parent().parent().settings
+        rect = self.scene().sceneRect()
+        # The largest resolution keeps the image within the size that can be exported
+        max_dpi = raster.maxDpi(rect)
+        dpi, ok = QInputDialog.getInt(self.parent().parent(), "Export Bitmap",
+                                      f"Resolution in dots per inch ({rect.width():g} by {rect.height():g} mm, at most "
+                                      f"{max_dpi}):",
+                                      min(settings.value("export_dpi", raster.DEFAULT_DPI, type=int), max_dpi), 1,
+                                      max_dpi)
+        if not ok:
+            return
+        settings.setValue("export_dpi", dpi)
+
+        # The tiles are painted in the background from a snapshot, while a progress dialog allows to cancel the export
+        progress = QProgressDialog("Exporting bitmap...", "Cancel", 0, 0, self.parent().parent())
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.setValue(0)
+        cancelled = []
+        progress.canceled.connect(lambda: cancelled.append(True))
+
+        def report(painted, tiles):
+            worker.signals.progress.emit(painted, tiles)
+            return not cancelled
+
+        def finished():
+            progress.reset()
+            progress.deleteLater()
+
+        def failed():
+            finished()
+            if not isinstance(worker.error, raster.CDExportCancelled):
+                QMessageBox.warning(self.parent().parent(), "Error", f"Failed to export the file: {worker.error}",
+                                    QMessageBox.StandardButton.Ok)
 
-        # Restore the selection
-        for item in wasselected:
-            item.setSelected(True)
+        worker = CDWorker(raster.export, file, self.chipSnapshot(), dpi, progress=report)
+        worker.signals.progress.connect(lambda painted, tiles: (progress.setMaximum(tiles), progress.setValue(painted)))
+        worker.signals.finished.connect(lambda _: finished())
+        worker.signals.failed.connect(lambda error: failed())
+        worker.start()
+
+    def exportVector(self, file):
+        # Coordinates are written with this many decimals of a millimeter
+        precision = vector.clampPrecision(
+            self.parent().parent().settings.value("export_precision", vector.DEFAULT_PRECISION, type=int))
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            vector.export(file, self.chipSnapshot(), precision)
+        except OSError as e:
+            QMessageBox.warning(self.parent().parent(), "Error", f"Failed to export the file: {e}",
+                                QMessageBox.StandardButton.Ok)
+        finally:
+            QApplication.restoreOverrideCursor()
+
+    def exportGDS(self, file):
+        # Layer numbers follow the order of the layers, starting at 1 for the top layer
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            gdsii.export(file, ((i + 1, layer.flatData()) for i, layer in enumerate(self.chip_layers)),
+                         self.chip_height)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self.parent().parent(), "Error", f"Failed to export the file: {e}",
+                                QMessageBox.StandardButton.Ok)
+        finally:
+            QApplication.restoreOverrideCursor()
 
     @pyqtSlot()
     def signal_export_3d(self):
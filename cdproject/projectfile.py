@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+from cdproject.serializers import serializerForContent, serializerForFile
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# Read once, because setting the mask to read it is not safe while other threads create files
+UMASK = _umask()
+
+
+def readProject(file):
+    return serializerForContent(file).load(file)
+
+
+def writeProject(data, file):
+    # The project is written to a temporary file next to the destination, which then replaces the destination in one
+    # step. A save that fails or is interrupted leaves the previous file as it was.
+    directory, name = os.path.split(os.path.abspath(file))
+    handle, temporary = tempfile.mkstemp(prefix="." + name + ".", suffix=".tmp", dir=directory)
+    os.close(handle)
+
+    try:
+        serializerForFile(file).dump(data, temporary)
+
+        with open(temporary, "rb") as f:
+            os.fsync(f.fileno())
+        # mkstemp creates files that only the owner can read
+        os.chmod(temporary, 0o666 & ~UMASK)
+        os.replace(temporary, file)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    return file
+
@@ -0,0 +1,234 @@
+import math
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QImage, QPainter
+
+# Bitmap export of any resolution. A snapshot of the chip is painted into fixed-size tiles on a pool of threads, and
+# every row of tiles is written to the file as soon as it is complete, so that only a few rows of tiles are in memory at
+# any time. The scene itself is never painted, since its items may only be used on the GUI thread.
+
+DEFAULT_DPI = 600
+TILE_SIZE = 1024
+
+# Number of rows of tiles that are rendered ahead of the row that is being written
+PREFETCH_ROWS = 2
+
+PNG_COMPRESSION = 6
+
+MM_PER_INCH = 25.4
+
+# The size of a BMP file is stored in 32 bits
+MAX_BMP_SIZE = 2 ** 32 - 1
+
+# Largest width or height of an exported image in pixels, which is also the most a JPEG can hold. A row of tiles of
+# this width takes 200 MB.
+MAX_IMAGE_SIZE = 65535
+
+
+class CDExportCancelled(Exception):
+    pass
+
+
+class CDPngWriter:
+    # Writes the image data row by row into a single IDAT stream, without filtering
+    def __init__(self, file, width, height):
+        self.file = file
+        self.width = width
+        self.height = height
+        self._stream = None
+        self._compressor = None
+        self._lines = None
+
+    def __enter__(self):
+        self._stream = open(self.file, "wb")
+        self._stream.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bits per sample, RGB
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0))
+        self._compressor = zlib.compressobj(PNG_COMPRESSION)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.chunk(b'IDAT', self._compressor.flush())
+                self.chunk(b'IEND')
+        finally:
+            self._stream.close()
+            # A file that misses rows is of no use
+            if exc_type is not None:
+                os.remove(self.file)
+
+    def chunk(self, kind, data=b''):
+        self._stream.write(struct.pack('>I', len(data)) + kind)
+        self._stream.write(data)
+        self._stream.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+    def write(self, rows):
+        # Rows are (height, width, 3) RGB, every row starts with filter type 0
+        if self._lines is None or len(self._lines) < len(rows):
+            self._lines = np.zeros((len(rows), 1 + 3 * self.width), dtype=np.uint8)
+        lines = self._lines[:len(rows)]
+        lines[:, 1:] = rows.reshape(len(rows), -1)
+        data = self._compressor.compress(lines.tobytes())
+        if data:
+            self.chunk(b'IDAT', data)
+
+
+class CDBmpWriter:
+    # 24-bit bitmap with a negative height, so that the rows are stored from the top down
+    def __init__(self, file, width, height):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.stride = (3 * width + 3) & ~3
+        self._stream = None
+        self._lines = None
+
+    def __enter__(self):
+        size = self.stride * self.height
+        if 54 + size > MAX_BMP_SIZE:
+            raise ValueError(f"A bitmap of {self.width} by {self.height} pixels does not fit in a BMP file, which can "
+                             f"hold at most 4 GiB. Choose a lower resolution or the PNG format.")
+
+        self._stream = open(self.file, "wb")
+        self._stream.write(b'BM' + struct.pack('<IHHI', 54 + size, 0, 0, 54))
+        self._stream.write(struct.pack('<IiiHHIIiiII', 40, self.width, -self.height, 1, 24, 0, size, 0, 0, 0, 0))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stream.close()
+        if exc_type is not None:
+            os.remove(self.file)
+
+    def write(self, rows):
+        # The padding at the end of every line stays zero
+        if self._lines is None or len(self._lines) < len(rows):
+            self._lines = np.zeros((len(rows), self.stride), dtype=np.uint8)
+        lines = self._lines[:len(rows)]
+        lines[:, :3 * self.width] = rows[..., ::-1].reshape(len(rows), -1)
+        self._stream.write(lines.tobytes())
+
+
+class CDImageWriter:
+    # Formats that can not be written in parts, such as JPEG, are put together in one image and saved by Qt
+    def __init__(self, file, width, height):
+        self.file = file
+        self.image = QImage(width, height, QImage.Format.Format_RGB888)
+        self.row = 0
+
+    def __enter__(self):
+        if self.image.isNull():
+            raise MemoryError(f"An image of {self.image.width()} by {self.image.height()} pixels does not fit in "
+                              f"memory")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and not self.image.save(self.file):
+            raise OSError(f"Could not write {self.file}")
+
+    def write(self, rows):
+        pixels = imageArray(self.image)
+        pixels[self.row:self.row + len(rows)] = rows
+        self.row += len(rows)
+
+
+WRITERS = {
+    '.png': CDPngWriter,
+    '.bmp': CDBmpWriter
+}
+
+
+def imageArray(image):
+    # (height, width, channels) view on the pixels of an image, without the padding at the end of every line
+    channels = image.depth() // 8
+    pixels = image.bits()
+    pixels.setsize(image.sizeInBytes())
+    lines = np.frombuffer(pixels, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return lines[:, :channels * image.width()].reshape(image.height(), image.width(), channels)
+
+
+def imageSize(rect, dpi):
+    scale = dpi / MM_PER_INCH
+    return max(1, math.ceil(rect.width() * scale)), max(1, math.ceil(rect.height() * scale))
+
+
+def maxDpi(rect):
+    # Highest resolution at which neither side of the image is larger than MAX_IMAGE_SIZE
+    dpi = max(1, math.floor(MAX_IMAGE_SIZE / max(rect.width(), rect.height(), 1e-9) * MM_PER_INCH))
+    # Rounding up the size in imageSize() can still push it a pixel over
+    while dpi > 1 and max(imageSize(rect, dpi)) > MAX_IMAGE_SIZE:
+        dpi -= 1
+    return dpi
+
+
+def renderTile(chip, scale, x, y, width, height):
+    # The last pixels of the image may lie partly outside the scene
+    image = QImage(width, height, QImage.Format.Format_RGBX8888)
+    image.fill(Qt.GlobalColor.white)
+
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    painter.translate(-x, -y)
+    painter.scale(scale, scale)
+    painter.translate(-chip.rect.left(), -chip.rect.top())
+    left, top = chip.rect.left() + x / scale, chip.rect.top() + y / scale
+    chip.paint(painter, left, top, left + width / scale, top + height / scale)
+    painter.end()
+
+    return imageArray(image)[..., :3].copy()
+
+
+def export(file, chip, dpi=DEFAULT_DPI, tile_size=TILE_SIZE, threads=None, progress=None):
+    # progress is called with the number of tiles that were painted and the number of tiles in the image. When it
+    # returns False, the export stops with CDExportCancelled and no partial file is left behind.
+    width, height = imageSize(chip.rect, dpi)
+    if max(width, height) > MAX_IMAGE_SIZE:
+        raise ValueError(f"An image of {width} by {height} pixels is too large, the resolution of this chip can be at "
+                         f"most {maxDpi(chip.rect)} dpi")
+    scale = dpi / MM_PER_INCH
+    writer = WRITERS.get(os.path.splitext(file)[1].lower(), CDImageWriter)
+    tiles = math.ceil(width / tile_size) * math.ceil(height / tile_size)
+
+    def renderRow(y):
+        lines = min(tile_size, height - y)
+        return [pool.submit(renderTile, chip, scale, x, y, min(tile_size, width - x), lines)
+                for x in range(0, width, tile_size)]
+
+    # Every row of tiles is put together in the same buffer, the last one may be lower than the others
+    row = np.empty((min(tile_size, height), width, 3), dtype=np.uint8)
+
+    def writeRow():
+        nonlocal painted
+        lines = 0
+        for x, tile in zip(range(0, width, tile_size), pending.popleft()):
+            pixels = tile.result()
+            lines = len(pixels)
+            row[:lines, x:x + pixels.shape[1]] = pixels
+            painted += 1
+            if progress is not None and progress(painted, tiles) is False:
+                raise CDExportCancelled()
+        output.write(row[:lines])
+
+    with ThreadPoolExecutor(threads) as pool, writer(file, width, height) as output:
+        pending = deque()
+        painted = 0
+        try:
+            for y in range(0, height, tile_size):
+                pending.append(renderRow(y))
+                if len(pending) > PREFETCH_ROWS:
+                    writeRow()
+
+            while pending:
+                writeRow()
+        except BaseException:
+            # Tiles that did not start yet are no longer needed
+            pool.shutdown(cancel_futures=True)
+            raise
+
+    return width, height
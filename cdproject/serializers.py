@@ -0,0 +1,140 @@
+import json
+import os
+
+import yaml
+
+try:
+    from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+    from yaml import Loader, Dumper
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from cdproject import binaryformat
+
+# Bytes read from the start of a file to recognize its format
+SNIFF_SIZE = 64
+
+
+class CDSerializer:
+    # Reads and writes the plain data of a project in one file format. Formats are recognized by the start of a file
+    # when opening, and chosen by the extension of the file when saving.
+    name = None
+    extension = None
+    available = True
+
+    def sniff(self, header):
+        return False
+
+    def load(self, file):
+        raise NotImplementedError
+
+    def dump(self, data, file):
+        raise NotImplementedError
+
+    def filter(self):
+        return f"{self.name} (*{self.extension})"
+
+
+class CDYamlSerializer(CDSerializer):
+    name = "Chip Drawer Project"
+    extension = ".cdp"
+
+    def sniff(self, header):
+        # Anything else is taken to be YAML, which is what all older projects are
+        return True
+
+    def load(self, file):
+        with open(file, "r") as f:
+            return yaml.load(f, Loader=Loader)
+
+    def dump(self, data, file):
+        with open(file, "w") as f:
+            yaml.dump(data, f, Dumper=Dumper)
+
+
+class CDJsonSerializer(CDSerializer):
+    name = "Chip Drawer JSON Project"
+    extension = ".cdpj"
+
+    def sniff(self, header):
+        return header.lstrip().startswith(b'{')
+
+    def load(self, file):
+        with open(file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def dump(self, data, file):
+        # json.dump encodes in small pieces in Python, json.dumps at once in C
+        with open(file, "w", encoding="utf-8") as f:
+            f.write(json.dumps(data, separators=(',', ':')))
+
+
+class CDMsgpackSerializer(CDSerializer):
+    name = "Chip Drawer MessagePack Project"
+    extension = ".cdpm"
+    available = msgpack is not None
+
+    def sniff(self, header):
+        # A project is a map: fixmap, map 16 or map 32
+        return bool(header) and (0x80 <= header[0] <= 0x8f or header[0] in (0xde, 0xdf))
+
+    def load(self, file):
+        with open(file, "rb") as f:
+            return msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+
+    def dump(self, data, file):
+        with open(file, "wb") as f:
+            f.write(msgpack.packb(data, use_bin_type=True))
+
+
+class CDBinarySerializer(CDSerializer):
+    name = "Chip Drawer Binary Project"
+    extension = ".cdpb"
+
+    def sniff(self, header):
+        return header.startswith(binaryformat.MAGIC)
+
+    def load(self, file):
+        return binaryformat.load(file)
+
+    def dump(self, data, file):
+        binaryformat.save(data, file)
+
+
+# In the order in which files are sniffed, with the fallback last
+SERIALIZERS = [s for s in (CDBinarySerializer(), CDMsgpackSerializer(), CDJsonSerializer(), CDYamlSerializer())
+               if s.available]
+DEFAULT_SERIALIZER = SERIALIZERS[-1]
+
+
+def serializerForFile(file):
+    # The format a file is saved in, by its extension
+    extension = os.path.splitext(file)[1].lower()
+    for serializer in SERIALIZERS:
+        if serializer.extension == extension:
+            return serializer
+    return DEFAULT_SERIALIZER
+
+
+def serializerForContent(file):
+    # The format of an existing file, by its first bytes
+    with open(file, "rb") as f:
+        header = f.read(SNIFF_SIZE)
+
+    for serializer in SERIALIZERS:
+        if serializer.sniff(header):
+            return serializer
+    return DEFAULT_SERIALIZER
+
+
+def saveFilters():
+    serializers = [DEFAULT_SERIALIZER] + [s for s in SERIALIZERS if s is not DEFAULT_SERIALIZER]
+    return ";;".join(s.filter() for s in serializers)
+
+
+def openFilter():
+    return f"Chip Drawer Project ({' '.join('*' + s.extension for s in SERIALIZERS)})"
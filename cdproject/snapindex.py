@@ -0,0 +1,228 @@
+import math
+
+import numpy as np
+
+
+class CDSnapIndex:
+    # Uniform grid over the snap points of all items, kept in scene coordinates so that scrolling and zooming the view
+    # never invalidates it. Snapping does not only look for points close by, but also aligns on a single axis, so every
+    # point is hashed both by its column and by its row. A query then only has to look at the columns and rows within
+    # the snap distance instead of at every snap point in the chip.
+    #
+    # Points are stored per owner (normally the item they belong to), so that a single item can be updated or removed
+    # without touching the rest of the chip.
+    #
+    # Matching is available in two flavours: candidates() walks the grid in Python, candidatesVectorized() matches all
+    # points at once against contiguous, sorted copies of the snap coordinates with NumPy. Both return the candidates
+    # that decide the snap, sorted by distance, as (point index, 'xy'|'x'|'y', snap position, distance, snap point)
+    # tuples.
+    def __init__(self, cell):
+        self.cell = cell
+
+        self._next = 0
+        self._owners = {}
+        self._points = {}
+        self._columns = {}
+        self._rows = {}
+
+        self._array = None
+        self._array_owners = None
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._points)
+
+    def clear(self):
+        self._next = 0
+        self._owners = {}
+        self._points = {}
+        self._columns = {}
+        self._rows = {}
+        self._invalidate()
+
+    def setCellSize(self, cell):
+        # Only rebucket when the snap distance drifted far away from the bucket size, so zooming in small steps stays
+        # cheap. Queries remain correct for any ratio, they just visit more or fewer buckets.
+        if self.cell / 2 <= cell <= self.cell * 2:
+            return
+
+        self.cell = cell
+        self._columns = {}
+        self._rows = {}
+        for i, (x, y, owner) in self._points.items():
+            self._bucket(i, x, y)
+
+    def set(self, owner, points):
+        self.remove(owner)
+
+        ids = []
+        for x, y in points:
+            i = self._next
+            self._next += 1
+            self._points[i] = (x, y, owner)
+            self._bucket(i, x, y)
+            ids.append(i)
+
+        self._owners[owner] = ids
+        self._invalidate()
+
+    def remove(self, owner):
+        if owner not in self._owners:
+            return
+
+        for i in self._owners.pop(owner):
+            x, y, _ = self._points.pop(i)
+            self._unbucket(self._columns, math.floor(x / self.cell), i)
+            self._unbucket(self._rows, math.floor(y / self.cell), i)
+        self._invalidate()
+
+    def __contains__(self, owner):
+        return owner in self._owners
+
+    def query(self, x, y, dist, exclude=()):
+        # All points that could lie within dist in x or in y, in insertion order, so that callers see the candidates in
+        # the same order as when walking the full list.
+        found = set()
+        for c in range(math.floor((x - dist) / self.cell), math.floor((x + dist) / self.cell) + 1):
+            found.update(self._columns.get(c, ()))
+        for c in range(math.floor((y - dist) / self.cell), math.floor((y + dist) / self.cell) + 1):
+            found.update(self._rows.get(c, ()))
+
+        points = [self._points[i] for i in sorted(found)]
+        if exclude:
+            return [(px, py) for px, py, owner in points if owner not in exclude]
+        return [(px, py) for px, py, _ in points]
+
+    def candidates(self, points, dist, exclude=()):
+        snaps = []
+
+        for i, (px, py) in enumerate(points):
+            for sx, sy in self.query(px, py, dist, exclude):
+                dx = abs(px - sx)
+                dy = abs(py - sy)
+                if dx >= dist and dy >= dist:
+                    continue
+
+                d = math.sqrt(dx ** 2 + dy ** 2)
+                if dx < dist and dy < dist:
+                    snaps += [(i, 'xy', (sx, sy), d, (sx, sy))]
+                if dx < dist:
+                    snaps += [(i, 'x', (sx, py), d, (sx, sy))]
+                if dy < dist:
+                    snaps += [(i, 'y', (px, sy), d, (sx, sy))]
+
+        snaps.sort(key=lambda snap: snap[3])
+        return snaps
+
+    def candidatesVectorized(self, points, dist, exclude=()):
+        # Instead of every match, only the ones that can decide the snap are returned: the closest xy, x and y match
+        # overall, and the closest and farthest x and y match of the point that has the closest match of all (the
+        # caller settles on the last alignment of that point in distance order).
+        snaps, order_x, sorted_x, order_y, sorted_y = self._snapArrays(exclude)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(snaps) or not len(points):
+            return []
+
+        # With the snaps sorted along both axes, the matches of every point are a contiguous range in each order
+        ix, jx = self._ranges(points[:, 0], sorted_x, order_x, dist)
+        iy, jy = self._ranges(points[:, 1], sorted_y, order_y, dist)
+        i = np.concatenate((ix, iy))
+        j = np.concatenate((jx, jy))
+        if not len(i):
+            return []
+
+        dx = np.abs(points[i, 0] - snaps[j, 0])
+        dy = np.abs(points[i, 1] - snaps[j, 1])
+        d = np.hypot(dx, dy)
+        mx = dx < dist
+        my = dy < dist
+
+        hits = set()
+        for mask in (mx & my, mx, my):
+            hit = self._closest(d, i, j, mask, len(snaps))
+            if hit is not None:
+                hits.add(hit)
+
+        # Alignment on the other axis can only combine with a match of the same point
+        first = self._closest(d, i, j, mx | my, len(snaps))
+        row = i == i[first]
+        for mask in (row & mx, row & my):
+            hit = self._closest(d, i, j, mask, len(snaps))
+            if hit is not None:
+                hits.add(hit)
+                hits.add(self._closest(-d, -i, -j, mask, len(snaps)))
+
+        result = []
+        for k in sorted(hits, key=lambda k: (d[k], i[k], j[k])):
+            px, py = (float(c) for c in points[i[k]])
+            sx, sy = (float(c) for c in snaps[j[k]])
+            if mx[k] and my[k]:
+                result.append((int(i[k]), 'xy', (sx, sy), float(d[k]), (sx, sy)))
+            if mx[k]:
+                result.append((int(i[k]), 'x', (sx, py), float(d[k]), (sx, sy)))
+            if my[k]:
+                result.append((int(i[k]), 'y', (px, sy), float(d[k]), (sx, sy)))
+
+        # The same pair can be found along both axes, only keep it once
+        return list(dict.fromkeys(result))
+
+    @staticmethod
+    def _ranges(coords, sorted_coords, order, dist):
+        # All (point, snap) pairs with the snap strictly within dist along one axis. coords ± dist is rounded, so it can
+        # end up on either side of a snap for which abs(coord - snap) < dist holds (4.9 - 0.1 gives 4.800000000000001).
+        # The ranges are therefore widened by a few units in the last place, and the pairs tested the way candidates()
+        # tests them.
+        slack = 4 * np.spacing(np.abs(coords) + dist)
+        lo = np.searchsorted(sorted_coords, coords - dist - slack, side='left')
+        hi = np.searchsorted(sorted_coords, coords + dist + slack, side='right')
+        counts = np.maximum(hi - lo, 0)
+
+        i = np.repeat(np.arange(len(coords)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        k = np.repeat(lo, counts) + offsets
+        inside = np.abs(coords[i] - sorted_coords[k]) < dist
+        return i[inside], order[k[inside]]
+
+    @staticmethod
+    def _closest(d, i, j, mask, n):
+        # Index of the closest masked pair, ties broken by point and then by snap insertion order
+        if not mask.any():
+            return None
+        candidates = np.flatnonzero(mask)
+        nearest = candidates[d[candidates] == d[candidates].min()]
+        return int(nearest[np.argmin(i[nearest] * n + j[nearest])])
+
+    def _snapArrays(self, exclude):
+        if self._array is None:
+            self._array = np.array([(x, y) for x, y, _ in self._points.values()], dtype=np.float64).reshape(-1, 2)
+            self._array_owners = [owner for _, _, owner in self._points.values()]
+
+        # While dragging, the same exclusion set is passed for every move, so the arrays only need to be built once
+        if self._sorted is None or self._sorted[0] is not exclude:
+            snaps = self._array
+            if exclude:
+                mask = np.fromiter((owner not in exclude for owner in self._array_owners), dtype=bool,
+                                   count=len(self._array_owners))
+                snaps = snaps[mask]
+
+            order_x = np.argsort(snaps[:, 0], kind='stable')
+            order_y = np.argsort(snaps[:, 1], kind='stable')
+            self._sorted = (exclude, (snaps, order_x, snaps[order_x, 0], order_y, snaps[order_y, 1]))
+
+        return self._sorted[1]
+
+    def _invalidate(self):
+        self._array = None
+        self._array_owners = None
+        self._sorted = None
+
+    def _bucket(self, i, x, y):
+        self._columns.setdefault(math.floor(x / self.cell), set()).add(i)
+        self._rows.setdefault(math.floor(y / self.cell), set()).add(i)
+
+    @staticmethod
+    def _unbucket(buckets, c, i):
+        bucket = buckets[c]
+        bucket.discard(i)
+        if not bucket:
+            del buckets[c]
@@ -0,0 +1,96 @@
+from functools import lru_cache
+
+import numpy as np
+from PyQt6.QtCore import QPointF, QRectF, Qt
+from PyQt6.QtGui import QBrush, QColor, QPen, QPolygonF, QTransform
+
+from buildingblocks import geometry
+
+# Plain copy of what the scene shows, for exporters that work off the GUI thread or without a scene at all
+
+BACKGROUND_COLOR = QColor(Qt.GlobalColor.white)
+OUTLINE_COLOR = QColor(Qt.GlobalColor.black)
+OUTLINE_WIDTH = 0.01
+
+
+class CDLayerSnapshot:
+    # What is needed to draw one layer: its colors and, per block item, the scene bounding rectangle and the data of the
+    # blocks it consists of
+    def __init__(self, color, substrate=None, name="", material=""):
+        self.color = QColor(color)
+        self.substrate = QColor(substrate) if substrate is not None else None
+        self.name = name
+        self.material = material
+        self.items = []
+        self._bounds = []
+
+    def addItem(self, rect, blocks):
+        self._bounds.append((rect.left(), rect.top(), rect.right(), rect.bottom()))
+        self.items.append(blocks)
+
+    def addBlocks(self, blocks):
+        # Blocks without an item in a scene, such as those of a project file, are bounded by their outlines
+        outlines = np.concatenate([geometry.chipOutline(data) for data in blocks])
+        (left, top), (right, bottom) = outlines.min(axis=0), outlines.max(axis=0)
+        self.addItem(QRectF(QPointF(left, top), QPointF(right, bottom)), blocks)
+
+    def finish(self):
+        self.bounds = np.array(self._bounds, dtype=np.float64).reshape(-1, 4)
+        del self._bounds
+
+    def blocks(self):
+        for blocks in self.items:
+            yield from blocks
+
+    def itemsIn(self, left, top, right, bottom):
+        hit = ((self.bounds[:, 0] <= right) & (self.bounds[:, 2] >= left) &
+               (self.bounds[:, 1] <= bottom) & (self.bounds[:, 3] >= top))
+        return (self.items[i] for i in np.flatnonzero(hit))
+
+
+class CDChipSnapshot:
+    # Layers are drawn in the order they are added, so the bottom layer goes first
+    def __init__(self, rect, chip_width, chip_height):
+        self.rect = QRectF(rect)
+        self.chip_width = chip_width
+        self.chip_height = chip_height
+        self.layers = []
+
+    def addLayer(self, layer):
+        layer.finish()
+        self.layers.append(layer)
+
+    def chipRect(self):
+        return QRectF(0, 0, self.chip_width, self.chip_height)
+
+    def paint(self, painter, left, top, right, bottom):
+        # Paints the part of the chip within the given scene rectangle, as the scene would
+        painter.fillRect(self.rect, BACKGROUND_COLOR)
+
+        painter.setPen(QPen(Qt.PenStyle.NoPen))
+        for layer in self.layers:
+            if layer.substrate is not None:
+                painter.fillRect(self.chipRect(), layer.substrate)
+
+            # Every block is painted as the polygon of its shape, through its own transformation
+            painter.setBrush(QBrush(layer.color))
+            view = painter.worldTransform()
+            for blocks in layer.itemsIn(left, top, right, bottom):
+                for data in blocks:
+                    painter.setWorldTransform(QTransform(*geometry.dataTransform(data).ravel()) * view)
+                    painter.drawPolygon(shapePolygon(data))
+            painter.setWorldTransform(view)
+
+        painter.setBrush(QBrush(Qt.BrushStyle.NoBrush))
+        painter.setPen(QPen(QBrush(OUTLINE_COLOR), OUTLINE_WIDTH, Qt.PenStyle.DashLine))
+        painter.drawRect(self.chipRect())
+
+
+def shapePolygon(data):
+    return _polygon(geometry.shapeKey(data), geometry.chord_error)
+
+
+@lru_cache(maxsize=4096)
+def _polygon(key, tolerance):
+    # QPolygonF is implicitly shared, so the same polygon can be painted from several threads at once
+    return QPolygonF([QPointF(x, y) for x, y in geometry.shapeOutline(key).tolist()])
@@ -0,0 +1,164 @@
+import os
+import re
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+from PyQt6.QtCore import QMarginsF, QPointF, QSizeF, Qt
+from PyQt6.QtGui import QBrush, QPageLayout, QPageSize, QPainter, QPainterPath, QPdfWriter, QPen, QPolygonF
+
+from buildingblocks import geometry
+from cdproject.snapshot import BACKGROUND_COLOR, OUTLINE_COLOR, OUTLINE_WIDTH
+
+# SVG and PDF export of a snapshot of the chip, in which all blocks of a layer are one compound path. The outlines are
+# all given the same orientation, so that with the nonzero fill rule blocks that overlap fill each other instead of
+# cutting holes. Coordinates are rounded to a number of decimals of a millimeter, and in SVG they are written as
+# integers in units of that precision.
+
+DEFAULT_PRECISION = 4
+# With more decimals than this, coordinates are finer than a picometer
+MAX_PRECISION = 9
+
+# QSvgRenderer (Qt SVG) refuses path data that adds up to more than 0x7fff QPainterPath elements: it logs "Invalid path
+# data; path truncated." and leaves out the whole path (seen with Qt 6.11). Browsers and Inkscape have no such limit,
+# but so that the files can also be shown with Qt, a layer that needs more elements continues in another path of its
+# class.
+MAX_PATH_ELEMENTS = 0x7fff
+
+# The dash pattern of Qt's DashLine, in pen widths
+DASH_PATTERN = (4, 2)
+
+MM_PER_INCH = 25.4
+
+
+def clampPrecision(precision):
+    # A negative precision would make the coordinates of SVG files fractions
+    return min(max(int(precision), 0), MAX_PRECISION)
+
+
+def layerPolygons(layer, precision):
+    # Outlines of the blocks of a layer as (N, 2) integers in units of the precision, all counterclockwise on screen
+    scale = 10 ** precision
+    for data in layer.blocks():
+        points = np.rint(geometry.chipOutline(data) * scale).astype(np.int64)
+
+        # Points that fall together after rounding would only add empty segments
+        points = points[np.any(points != np.roll(points, 1, axis=0), axis=1)]
+        if len(points) < 3:
+            continue
+
+        # Twice the signed area, in floating point since the products can overflow integers at a high precision
+        x, y = (points - points[0]).astype(np.float64).T
+        if np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y) < 0:
+            points = points[::-1]
+        yield points
+
+
+def styleName(name, used):
+    # CSS class for a material, readable where the name allows
+    base = re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or "material"
+    style, n = base, 1
+    while style in used:
+        n += 1
+        style = f"{base}-{n}"
+    return style
+
+
+def exportSvg(file, chip, precision=DEFAULT_PRECISION):
+    scale = 10 ** precision
+    rect = chip.rect
+
+    def box(r):
+        return (f'x="{round(r.left() * scale)}" y="{round(r.top() * scale)}" '
+                f'width="{round(r.width() * scale)}" height="{round(r.height() * scale)}"')
+
+    # One class for every combination of material and color, shared by all layers that use it
+    styles = {}
+    for layer in chip.layers:
+        if layer.substrate is not None and ('substrate', layer.substrate.name()) not in styles:
+            styles['substrate', layer.substrate.name()] = styleName("substrate", styles.values())
+        if (layer.material, layer.color.name()) not in styles:
+            styles[layer.material, layer.color.name()] = styleName(f"material-{layer.material}", styles.values())
+
+    outline = round(OUTLINE_WIDTH * scale)
+    with open(file, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" '
+                f'xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" '
+                f'width="{rect.width():g}mm" height="{rect.height():g}mm" '
+                f'viewBox="{round(rect.left() * scale)} {round(rect.top() * scale)} '
+                f'{round(rect.width() * scale)} {round(rect.height() * scale)}">\n')
+
+        f.write('<style>\n')
+        f.write(f'.background{{fill:{BACKGROUND_COLOR.name()}}}\n')
+        for (material, color), style in styles.items():
+            f.write(f'.{style}{{fill:{color}}}\n')
+        f.write(f'.outline{{fill:none;stroke:{OUTLINE_COLOR.name()};stroke-width:{outline};'
+                f'stroke-dasharray:{DASH_PATTERN[0] * outline} {DASH_PATTERN[1] * outline}}}\n')
+        f.write('</style>\n')
+
+        f.write(f'<rect class="background" {box(rect)}/>\n')
+
+        for i, layer in enumerate(chip.layers):
+            f.write(f'<g id="layer-{i + 1}" inkscape:groupmode="layer" inkscape:label={quoteattr(layer.name)}>\n')
+            if layer.substrate is not None:
+                f.write(f'<rect class="{styles["substrate", layer.substrate.name()]}" {box(chip.chipRect())}/>\n')
+
+            path = f'<path class="{styles[layer.material, layer.color.name()]}" d="'
+            elements = None
+            for points in layerPolygons(layer, precision):
+                # Every point is an element, and so is closing the outline, the way Qt counts them
+                if elements is None or elements + len(points) + 1 > MAX_PATH_ELEMENTS:
+                    f.write(path if elements is None else '"/>\n' + path)
+                    elements = 0
+                elements += len(points) + 1
+
+                x, y = points[0].tolist()
+                f.write(f'M{x} {y}l{" ".join(map(str, np.diff(points, axis=0).ravel().tolist()))}z')
+            if elements is not None:
+                f.write('"/>\n')
+            f.write('</g>\n')
+
+        f.write(f'<rect class="outline" {box(chip.chipRect())}/>\n')
+        f.write('</svg>\n')
+
+
+def exportPdf(file, chip, precision=DEFAULT_PRECISION):
+    rect = chip.rect
+
+    writer = QPdfWriter(file)
+    writer.setCreator("Chip Drawer")
+    writer.setPageSize(QPageSize(QSizeF(rect.width(), rect.height()), QPageSize.Unit.Millimeter))
+    writer.setPageMargins(QMarginsF(0, 0, 0, 0), QPageLayout.Unit.Millimeter)
+
+    painter = QPainter()
+    if not painter.begin(writer):
+        raise OSError(f"Could not write {file}")
+
+    painter.scale(writer.resolution() / MM_PER_INCH, writer.resolution() / MM_PER_INCH)
+    painter.translate(-rect.left(), -rect.top())
+    painter.fillRect(rect, BACKGROUND_COLOR)
+
+    scale = 10 ** precision
+    for layer in chip.layers:
+        if layer.substrate is not None:
+            painter.fillRect(chip.chipRect(), layer.substrate)
+
+        path = QPainterPath()
+        path.setFillRule(Qt.FillRule.WindingFill)
+        for points in layerPolygons(layer, precision):
+            path.addPolygon(QPolygonF([QPointF(x, y) for x, y in (points / scale).tolist()]))
+            path.closeSubpath()
+        painter.fillPath(path, layer.color)
+
+    painter.setBrush(QBrush(Qt.BrushStyle.NoBrush))
+    painter.setPen(QPen(QBrush(OUTLINE_COLOR), OUTLINE_WIDTH, Qt.PenStyle.DashLine))
+    painter.drawRect(chip.chipRect())
+    painter.end()
+
+
+def export(file, chip, precision=DEFAULT_PRECISION):
+    precision = clampPrecision(precision)
+    if os.path.splitext(file)[1].lower() == ".pdf":
+        exportPdf(file, chip, precision)
+    else:
+        exportSvg(file, chip, precision)
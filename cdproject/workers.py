@@ -0,0 +1,35 @@
+import traceback
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class CDWorkerSignals(QObject):
+    # QRunnable is not a QObject, so the results are passed back to the GUI thread through a separate object
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
+
+
+class CDWorker(QRunnable):
+    # Runs a function in the global thread pool. Only plain data should go in and out, never items of the scene.
+    def __init__(self, function, *args, **kwargs):
+        super().__init__()
+
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = CDWorkerSignals()
+        self.error = None
+
+    def run(self):
+        try:
+            result = self.function(*self.args, **self.kwargs)
+        except Exception as e:
+            self.error = e
+            self.signals.failed.emit(traceback.format_exc())
+        else:
+            self.signals.finished.emit(result)
+
+    def start(self, pool=None):
+        (pool or QThreadPool.globalInstance()).start(self)
+        return self
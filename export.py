@@ -0,0 +1,229 @@
+# Exports projects without the user interface, for example to regenerate the figures of many chips at once. The files
+# are spread over a pool of processes, which paint with Qt's offscreen platform.
+#
+#   python export.py chips/*.cdp --format png --format svg --dpi 1200 --output figures
+#   python export.py chip.cdp --format pdf --precision 3
+#   python export.py chip.cdp --format gds --format obj --width 30 --height 15
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import glob
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt6.QtCore import QRectF, QSettings, Qt
+from PyQt6.QtGui import QGuiApplication
+
+from buildingblocks import geometry
+from buildingblocks.cells import CDCell
+from cdproject import gdsii, raster, vector
+from cdproject.journal import CDJournal, readJournal, readSavedProject
+from cdproject.snapshot import CDChipSnapshot, CDLayerSnapshot
+from cdproject.theme import CDThemeList
+
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+# Output formats and the extension of the files they write. Formats starting with 3d need PyVista.
+FORMATS = {
+    'png': '.png',
+    'jpg': '.jpg',
+    'bmp': '.bmp',
+    'svg': '.svg',
+    'pdf': '.pdf',
+    'gds': '.gds',
+    '3d-png': '-3d.png',
+    'obj': '.obj',
+    'gltf': '.gltf',
+    'html': '.html'
+}
+FORMATS_3D = ('3d-png', 'obj', 'gltf', 'html')
+
+# The same defaults as the application
+DEFAULT_CHIP_WIDTH = 20
+DEFAULT_CHIP_HEIGHT = 10
+DEFAULT_CHIP_MARGIN = 2
+
+application = None
+
+
+def startWorker(chord_error):
+    # Every process paints with an application of its own, and discretizes curves as the application does
+    global application
+    application = QGuiApplication.instance() or QGuiApplication([])
+    geometry.setChordError(chord_error)
+
+
+def loadChip(file, themes):
+    # The theme and the layers of a project as it was last saved, from the top layer down. Every layer comes with the
+    # blocks of each of its items, where the instances of cells are expanded into the blocks of the cell.
+    data = readSavedProject(file)
+
+    theme = themes.getTheme(data['theme'])
+    if theme is None:
+        raise ValueError(f"The theme {data['theme']} is not installed")
+
+    cells = {cell['name']: CDCell.fromData(cell) for cell in data.get('cells', [])}
+
+    layers = []
+    for layer in sorted(data['layers'], key=lambda x: x['position']):
+        content = layer['content']
+        items = [cells[item['cell']].expand(item) if item['type'] == 'instance' else [item]
+                 for item in content['items']]
+        layers.append((content, [blocks for blocks in items if blocks]))
+
+    return theme, layers
+
+
+def chipSnapshot(theme, layers, width, height, margin):
+    # The visible layers from the bottom up, like the scene shows them
+    chip = CDChipSnapshot(QRectF(-margin, -margin, width + 2 * margin, height + 2 * margin), width, height)
+    for content, items in reversed(layers):
+        if not content['visible']:
+            continue
+        material = theme.material(content['material'])[1]
+        layer = CDLayerSnapshot(material.displayColor, Qt.GlobalColor.blue if content['substrate'] else None,
+                                content['name'], material.name)
+        for blocks in items:
+            layer.addBlocks(blocks)
+        chip.addLayer(layer)
+
+    return chip
+
+
+def export3D(file, kind, theme, layers, width, height):
+    import pyvista as pv
+
+    from cd3dviewer import addChip
+
+    plotter = pv.Plotter(off_screen=True)
+    try:
+        plotter.background_color = 'white'
+        addChip(plotter, theme, ((content['substrate'], content['thickness'], theme.material(content['material'])[1],
+                                  theme.material(content['background_material'])[1], items)
+                                 for content, items in reversed(layers)), width, height)
+
+        match kind:
+            case '3d-png':
+                plotter.screenshot(file)
+            case 'obj':
+                plotter.export_obj(file)
+            case 'gltf':
+                plotter.export_gltf(file)
+            case 'html':
+                plotter.export_html(file)
+    finally:
+        plotter.close()
+
+
+def exportFile(file, formats, output, options):
+    # Runs in a worker process. Returns the written files, the errors of the formats that could not be written and
+    # warnings about the project.
+    warnings = []
+    try:
+        theme, layers = loadChip(file, CDThemeList(options['themes']))
+    except Exception:
+        return [], [traceback.format_exc()], warnings
+
+    # A journal that does not belong to the file as it is on disk, for example because the file was copied and got a
+    # new modification time, may hold saved changes that are not exported
+    if os.path.exists(CDJournal.journalFile(file)) and readJournal(file) is None:
+        warnings.append(f"{CDJournal.journalFile(file)} does not belong to the project file and was ignored, open the "
+                        f"project in Chip Drawer to check it")
+
+    width, height, margin = options['width'], options['height'], options['margin']
+
+    base = os.path.join(output or os.path.dirname(file), os.path.splitext(os.path.basename(file))[0])
+    chip = None
+    written, errors = [], []
+    for kind in formats:
+        target = base + FORMATS[kind]
+        try:
+            if kind in FORMATS_3D:
+                export3D(target, kind, theme, layers, width, height)
+            elif kind == 'gds':
+                gdsii.export(target, ((i + 1, (data for blocks in items for data in blocks))
+                                      for i, (content, items) in enumerate(layers)), height)
+            else:
+                if chip is None:
+                    chip = chipSnapshot(theme, layers, width, height, margin)
+                if kind in ('svg', 'pdf'):
+                    vector.export(target, chip, options['precision'])
+                else:
+                    raster.export(target, chip, options['dpi'], threads=1)
+        except Exception:
+            errors.append(f"{kind}: {traceback.format_exc()}")
+        else:
+            written.append(target)
+
+    return written, errors, warnings
+
+
+def defaultConfiguration():
+    # The settings of the application when it has been run before, otherwise those of the repository
+    settings = QSettings(QSettings.Format.IniFormat, QSettings.Scope.UserScope, "Chip Drawer", "Chip Drawer")
+    directory = os.path.dirname(settings.fileName())
+    if not os.path.isdir(os.path.join(directory, "themes")):
+        directory = os.path.join(REPOSITORY, "configuration")
+
+    return settings, directory
+
+
+def main():
+    settings, directory = defaultConfiguration()
+
+    parser = argparse.ArgumentParser(description="Export Chip Drawer projects without opening the application")
+    parser.add_argument("files", nargs="+", help="projects to export, wildcards are expanded")
+    parser.add_argument("-f", "--format", action="append", choices=list(FORMATS), dest="formats",
+                        help="format to write, may be given more than once (default png)")
+    parser.add_argument("-o", "--output", help="directory for the exported files (default next to every project)")
+    parser.add_argument("--dpi", type=int, default=settings.value("export_dpi", raster.DEFAULT_DPI, type=int),
+                        help=f"resolution of bitmaps, at most what keeps their sides within {raster.MAX_IMAGE_SIZE} "
+                             f"pixels")
+    parser.add_argument("--precision", type=int, choices=range(vector.MAX_PRECISION + 1),
+                        default=vector.clampPrecision(
+                            settings.value("export_precision", vector.DEFAULT_PRECISION, type=int)),
+                        help="decimals of a millimeter in vector formats", metavar=f"0-{vector.MAX_PRECISION}")
+    parser.add_argument("--width", type=float,
+                        default=settings.value("default_chip_width", DEFAULT_CHIP_WIDTH, type=float))
+    parser.add_argument("--height", type=float,
+                        default=settings.value("default_chip_height", DEFAULT_CHIP_HEIGHT, type=float))
+    parser.add_argument("--margin", type=float,
+                        default=settings.value("default_chip_margin", DEFAULT_CHIP_MARGIN, type=float))
+    parser.add_argument("--chord-error", type=float,
+                        default=settings.value("max_chord_error", geometry.DEFAULT_CHORD_ERROR, type=float),
+                        help="largest distance in mm between a curve and the segments it is drawn with")
+    parser.add_argument("--themes", default=directory, help="directory with the themes directory in it")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of processes")
+    args = parser.parse_args()
+    if args.dpi < 1:
+        parser.error("--dpi must be at least 1")
+
+    files = [match for pattern in args.files for match in (sorted(glob.glob(pattern)) or [pattern])]
+    formats = args.formats or ['png']
+    options = {'dpi': args.dpi, 'precision': args.precision, 'width': args.width, 'height': args.height,
+               'margin': args.margin, 'themes': args.themes}
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    failed = 0
+    with ProcessPoolExecutor(max(1, min(args.jobs, len(files))), initializer=startWorker,
+                             initargs=(args.chord_error,)) as pool:
+        jobs = [pool.submit(exportFile, file, formats, args.output, options) for file in files]
+        for file, job in zip(files, jobs):
+            written, errors, warnings = job.result()
+            for warning in warnings:
+                print(f"{file}: warning: {warning}", file=sys.stderr)
+            if written:
+                print(f"{file}: {', '.join(written)}")
+            if errors:
+                failed += 1
+                print(f"{file}: failed\n" + "\n".join(errors), file=sys.stderr)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -44,7 +44,9 @@ extra = {
 
 if __name__ == "__main__":
     app = QApplication([])
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID("chipdrawer.chipdrawer.v0.1")
+    # Gives the application its own icon in the Windows task bar
+    if os.name == "nt":
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID("chipdrawer.chipdrawer.v0.1")
 
     splash = QSplashScreen(QPixmap("graphics/splash.png"))
     splash.show()
@@ -67,6 +69,16 @@ if __name__ == "__main__":
         settings.setValue("default_chip_height", 10)
     if not settings.contains("default_chip_margin"):
         settings.setValue("default_chip_margin", 2)
+    if not settings.contains("lod_simplified_threshold"):
+        settings.setValue("lod_simplified_threshold", 24)
+    if not settings.contains("lod_box_threshold"):
+        settings.setValue("lod_box_threshold", 4)
+    if not settings.contains("max_chord_error"):
+        settings.setValue("max_chord_error", 0.001)
+    if not settings.contains("export_dpi"):
+        settings.setValue("export_dpi", 600)
+    if not settings.contains("export_precision"):
+        settings.setValue("export_precision", 4)
 
     settings.sync()
 
@@ -6,7 +6,8 @@ from PyQt6.QtGui import QCloseEvent, QUndoStack
 from PyQt6.QtWidgets import QMainWindow, QMessageBox
 
 from CDItemDelegate import CDItemDelegate
-from buildingblocks import CDBuildingBlockList
+from buildingblocks import CDBuildingBlockList, geometry
+from buildingblocks.blockitem import CDBlockItem
 from cd3dviewer import CD3DViewer
 
 
@@ -39,6 +40,14 @@ class MainWindow(QMainWindow):
         # Pass the undostack on to the project
         self.drawing_area.setUndoStack(self.undostack)
 
+        # Zoom levels at which blocks are painted with less detail
+        CDBlockItem.lod_simplified = self.settings.value("lod_simplified_threshold", CDBlockItem.lod_simplified,
+                                                         type=float)
+        CDBlockItem.lod_box = self.settings.value("lod_box_threshold", CDBlockItem.lod_box, type=float)
+
+        # Accuracy with which arcs and curves are discretized, for drawing as well as for exports
+        geometry.setChordError(self.settings.value("max_chord_error", geometry.DEFAULT_CHORD_ERROR, type=float))
+
         self.btn_add_layer.setProperty('class', 'success')
         self.btn_remove_layer.setProperty('class', 'danger')
 
@@ -64,6 +73,10 @@ class MainWindow(QMainWindow):
     def signal_save_as(self):
         self.drawing_area.project_save(saveas=True)
 
+    @pyqtSlot()
+    def signal_compact(self):
+        self.drawing_area.project_save(compact=True)
+
     @pyqtSlot()
     def signal_export(self):
         self.drawing_area.project_save(export=True)
@@ -77,7 +90,7 @@ class MainWindow(QMainWindow):
 
             if d == QMessageBox.StandardButton.Yes:
                 # We want to save
-                if not self.drawing_area.project_save():
+                if not self.drawing_area.project_save(wait=True):
                     # In case saving was cancelled
                     return
             elif d == QMessageBox.StandardButton.Cancel:
@@ -95,7 +108,7 @@ class MainWindow(QMainWindow):
 
             if d == QMessageBox.StandardButton.Yes:
                 # We want to save
-                if not self.drawing_area.project_save():
+                if not self.drawing_area.project_save(wait=True):
                     # In case saving was cancelled
                     return
             elif d == QMessageBox.StandardButton.Cancel:
@@ -113,7 +126,7 @@ class MainWindow(QMainWindow):
 
             if d == QMessageBox.StandardButton.Yes:
                 # We want to save
-                if not self.drawing_area.project_save():
+                if not self.drawing_area.project_save(wait=True):
                     # In case saving was cancelled
                     event.ignore()
                     return
@@ -122,6 +135,10 @@ class MainWindow(QMainWindow):
                 event.ignore()
                 return
 
+        # The project file is rewritten from its journal in the background, which has to finish before Chip Drawer stops
+        self.drawing_area.project_close()
+        self.drawing_area.finishSaving()
+
         event.accept()
 
     @pyqtSlot(bool)